@@ -1,19 +1,75 @@
 import collections
-import functools
+import fractions
+import inspect
+import weakref
 
 import sympy
 
+from pysteg.common.bits import Bits
 from pysteg.crypto import random_bits
 
 Interval = collections.namedtuple("Interval", "b l")
 
-# Rational numbers
-_half = sympy.Rational(1,2)
-_one = sympy.Rational(1)
+# Exact rational number types which intervals can be made of. Both give exactly
+# the same intervals, but Fraction only does plain integer arithmetic, without
+# the overhead of sympy.
+BACKENDS = {"sympy": sympy.Rational, "fraction": fractions.Fraction}
 
-# Half-unit intervals - [0, 1/2) for 0 and [1/2, 1/2) for 1
-_first_half = Interval(sympy.Rational(0), sympy.Rational(1,2))
-_second_half = Interval(sympy.Rational(1,2), sympy.Rational(1,2))
+# References to the functions clearing caches of intervals, see
+# on_backend_change
+_cache_clears = []
+
+def set_backend(name):
+    """
+    Choose the exact rational number type of all intervals created from now
+    on. Intervals of different backends should not be mixed, so the caches
+    registered with on_backend_change are cleared.
+    """
+
+    global _backend, _half, _one, _first_half, _second_half
+
+    _backend = BACKENDS[name]
+
+    for ref in _cache_clears:
+        clear = ref()
+        if clear is not None:
+            clear()
+
+    # Forget the methods of objects which no longer exist
+    _cache_clears[:] = [ref for ref in _cache_clears if ref() is not None]
+
+    # Rational numbers
+    _half = _backend(1,2)
+    _one = _backend(1)
+
+    # Half-unit intervals - [0, 1/2) for 0 and [1/2, 1/2) for 1
+    _first_half = Interval(_backend(0), _backend(1,2))
+    _second_half = Interval(_backend(1,2), _backend(1,2))
+
+def on_backend_change(clear):
+    """
+    Register a function clearing a cache of intervals, which is called whenever
+    the backend is changed. Bound methods are referenced weakly, so that their
+    objects can still be garbage collected.
+    """
+
+    if inspect.ismethod(clear):
+        _cache_clears.append(weakref.WeakMethod(clear))
+    else:
+        _cache_clears.append(lambda: clear)
+
+def rational(numerator, denominator=1):
+    """
+    Create an exact rational number of the current backend. The numerator can
+    also be a string of a rational number.
+    """
+
+    if denominator == 1:
+        return _backend(numerator)
+    else:
+        return _backend(numerator, denominator)
+
+set_backend("sympy")
 
 def bit2interval(bit):
     """Convert 0 and 1 to their half-unit intervals."""
@@ -27,7 +83,14 @@ def bit2interval(bit):
 
 def bits2interval(bits):
     """Convert a sequence of bits to the interval they describe."""
-    return functools.reduce(select_subinterval, map(bit2interval, bits))
+
+    # Packed bits are the binary digits of the base of a dyadic interval
+    bits = Bits(bits)
+    return dyadic_interval(bits.value, len(bits))
+
+def dyadic_interval(numerator, k):
+    """Return the interval [numerator/2^k, (numerator+1)/2^k)."""
+    return create_interval(numerator, 1, 1 << k)
 
 def interval2bit(interval, mode):
     """
@@ -66,31 +129,66 @@ def interval2bit(interval, mode):
 
 def interval2bits(interval, mode):
     """
-    Convert an interval to a sequence of bits that describe its smallest
-    superinterval or largest subinterval.
+    Convert an interval to packed bits that describe its smallest superinterval
+    or largest subinterval.
     """
 
     assert(mode in ("sub", "super"))
 
-    bits = []
+    # Instead of peeling the bits one by one with interval2bit, find the dyadic
+    # interval they describe with integer arithmetic. The interval is [B/D, E/D)
+    # and K bits are enough to tell it from any dyadic interval of its kind.
+    (bp, bq) = (interval.b.numerator, interval.b.denominator)
+    (lp, lq) = (interval.l.numerator, interval.l.denominator)
+    (B, E, D) = (bp*lq, bp*lq + lp*bq, bq*lq)
+
+    if mode == "super":
+        # The bits are the common leading bits of the base and of the numbers
+        # just below the end. The dyadic interval of K bits is shorter than
+        # the interval, so they cannot have K bits in common.
+        K = lq.bit_length() + 1
+
+        x = (B << K) // D
+        y = ((E << K) - 1) // D
+
+        k = K - (x ^ y).bit_length()
+    else:
+        # Every bit chooses the half containing the midpoint of the interval
+        # (the lower one if it is on the boundary), until the dyadic interval is
+        # a subinterval. The dyadic interval of K bits is at most half as long
+        # as the interval, so it is always a subinterval.
+        K = (2*D // (E-B) + 1).bit_length()
+
+        x = (((B+E) << K) - 1) // (2*D)
+
+        def is_subinterval(k):
+            j = x >> (K-k)
+            return j*D >= B << k and (j+1)*D <= E << k
+
+        # Find the smallest such number of bits with a binary search
+        (kmin, kmax) = (0, K)
+
+        while kmin < kmax:
+            kmid = (kmin+kmax) // 2
+
+            if is_subinterval(kmid):
+                kmax = kmid
+            else:
+                kmin = kmid + 1
 
-    next = interval2bit(interval, mode)
-    while next is not None:
-        bits.append(next[0])
-        interval = next[1]
-        next = interval2bit(interval, mode)
+        k = kmin
 
-    return tuple(bits)
+    return Bits.from_int(x >> (K-k), k)
 
-def create_interval(base, length, divisor=_one, subunit=True):
+def create_interval(base, length, divisor=1, subunit=True):
     """
     Create an interval. Make sure that its length is positive. In most cases the
     interval should be a sub-unit interval, i.e. a subinterval of [0,1). This is
     enforced by default.
     """
 
-    b = sympy.Rational(base, divisor)     # interval base
-    l = sympy.Rational(length, divisor)   # interval length
+    b = rational(base, divisor)     # interval base
+    l = rational(length, divisor)   # interval length
 
     # Interval has to have a positive length
     assert(l > 0)
@@ -112,6 +210,27 @@ def select_subinterval(interval, ratio, subunit=True):
         subunit=subunit
     )
 
+def dyadic_subinterval(interval, precision):
+    """
+    Return the largest subinterval whose ends are multiples of 2^-K, where K is
+    the given number of bits more than the bits of the inverse of the length.
+    The denominators stay within K bits and the subinterval is shorter by at
+    most a 2^(1-precision) fraction of the length.
+    """
+
+    assert(precision >= 2)
+
+    (lp, lq) = (interval.l.numerator, interval.l.denominator)
+    K = (lq // lp).bit_length() + precision
+
+    # Round the base up and the end down to multiples of 2^-K
+    end = interval.b + interval.l
+
+    B = -((-interval.b.numerator << K) // interval.b.denominator)
+    E = (end.numerator << K) // end.denominator
+
+    return create_interval(B, E-B, 1 << K)
+
 def is_subinterval(subinterval, interval, proper=False):
     """Return whether the first interval is a subinterval of the second."""
 
@@ -122,9 +241,12 @@ def is_subinterval(subinterval, interval, proper=False):
         return (subinterval.b >= interval.b and
                 subinterval.b + subinterval.l <= interval.b + interval.l)
 
-def random_interval(n, seed=None):
-    """Randomly generate a sub-unit interval corresponding to n bits."""
-    return bits2interval(random_bits(n, seed))
+def random_interval(n, seed=None, rng=None):
+    """
+    Randomly generate a sub-unit interval corresponding to n bits, optionally
+    drawn from a given source of random bits.
+    """
+    return bits2interval(random_bits(n, seed, rng))
 
 def find_ratio(interval, superinterval, subunit=True):
     """
@@ -148,6 +270,6 @@ def find_superinterval(subinterval, ratio, subunit=True):
     """
 
     return create_interval(
-        subinterval.b - sympy.Rational(ratio.b * subinterval.l, ratio.l),
+        subinterval.b - _backend(ratio.b * subinterval.l, ratio.l),
         subinterval.l / ratio.l
     )
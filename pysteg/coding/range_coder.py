@@ -0,0 +1,202 @@
+import collections
+import itertools
+
+# Interval of integer cumulative counts -- the symbol occupies counts [b, b+l)
+# out of the total count of all symbols. A conditional probability interval is
+# described by a sequence of them, one for each level of the conditional
+# probability tree (e.g. the back-off pseudo-tokens and then the token).
+CountInterval = collections.namedtuple("CountInterval", "b l total")
+
+class RangeEncoder:
+    """
+    Fixed-precision integer range coder. The current interval is kept in low
+    and range registers of the given number of bits, with low extended by a
+    carry bit. Its leading bits are shifted out and emitted as soon as the
+    range drops to half of the register, so the registers never grow.
+
+    A bit shifted out of low may still be changed by a carry, so the last
+    emitted 0 bit (the cache) and the 1 bits following it (pending) are only
+    emitted when a later bit settles them. Emitted bits are returned by each
+    step and not kept, so memory stays bounded for streams of any length.
+    """
+
+    def __init__(self, precision=64):
+        self.precision = precision
+        self.half = 1 << (precision-1)
+
+        self.low = 0
+        self.range = 1 << precision
+
+        self.cache = None
+        self.pending = 0
+
+    def _shift_low(self, bits):
+        """Shift out the leading bit of low, appending settled bits to bits."""
+
+        if self.low < self.half or self.low >> self.precision:
+            carry = self.low >> self.precision
+
+            if self.cache is None:
+                assert(carry == 0)
+            else:
+                bits.append(self.cache + carry)
+
+            bits.extend(itertools.repeat(1 - carry, self.pending))
+
+            self.cache = (self.low >> (self.precision-1)) & 1
+            self.pending = 0
+        else:
+            self.pending += 1
+
+        self.low = (self.low & (self.half-1)) << 1
+
+    def encode(self, count_interval):
+        """
+        Narrow the current interval down to an interval of counts. Return the
+        bits settled by this step.
+        """
+
+        (b, l, total) = count_interval
+
+        # Every symbol with a positive count gets a non-empty range, since the
+        # range is always greater than half of the register
+        assert(l > 0 and b >= 0 and b + l <= total <= self.half)
+
+        start = self.range * b // total
+        end = self.range * (b+l) // total
+
+        self.low += start
+        self.range = end - start
+
+        bits = []
+
+        while self.range <= self.half:
+            self._shift_low(bits)
+            self.range <<= 1
+
+        return tuple(bits)
+
+    def finish(self):
+        """
+        Terminate the code with the shortest sequence of bits, which followed
+        by any number of 0 bits lies within the current interval. Return the
+        bits settled by this step.
+        """
+
+        bits = []
+
+        # Find the shortest prefix of a value in the current interval
+        for k in range(self.precision+1):
+            unit = 1 << (self.precision-k)
+            value = -(-self.low // unit) * unit
+
+            if value < self.low + self.range:
+                break
+
+        self.low = value
+
+        for i in range(k):
+            self._shift_low(bits)
+
+        # Emit the cache and pending bits, absorbing the last carry
+        carry = self.low >> self.precision
+
+        if self.cache is not None:
+            bits.append(self.cache + carry)
+
+        bits.extend(itertools.repeat(1 - carry, self.pending))
+
+        (self.cache, self.pending) = (None, 0)
+
+        return tuple(bits)
+
+class RangeDecoder:
+    """
+    Decoder of bits produced by RangeEncoder with the same precision. Instead
+    of low it keeps the offset of the code value from the base of the current
+    interval, so no carries are needed. Input past the end of the bits is
+    read as 0 bits.
+    """
+
+    def __init__(self, bits, precision=64):
+        self.precision = precision
+        self.half = 1 << (precision-1)
+
+        self.bits = itertools.chain(bits, itertools.repeat(0))
+
+        self.range = 1 << precision
+        self.code = 0
+
+        for i in range(precision):
+            self.code = (self.code << 1) | next(self.bits)
+
+    def target(self, total):
+        """
+        Return the count out of the total count, whose interval of counts
+        contains the code value.
+        """
+
+        assert(total <= self.half)
+
+        return ((self.code+1) * total - 1) // self.range
+
+    def decode(self, count_interval):
+        """Narrow the current interval down to an interval of counts."""
+
+        (b, l, total) = count_interval
+
+        start = self.range * b // total
+        end = self.range * (b+l) // total
+
+        assert(start <= self.code < end)
+
+        self.code -= start
+        self.range = end - start
+
+        while self.range <= self.half:
+            self.code = (self.code << 1) | next(self.bits)
+            self.range <<= 1
+
+def encode(conditional_counts, sequence, precision=64, verbose=False):
+    """
+    Encode a sequence into bits with a fixed-precision range coder using the
+    supplied "conditional counts" function, which returns the intervals of
+    counts of a symbol given its context.
+    """
+
+    encoder = RangeEncoder(precision)
+    bits = []
+
+    for i in range(len(sequence)):
+        if verbose: print(sequence[i])
+        for count_interval in conditional_counts(sequence[i], sequence[:i]):
+            bits.extend(encoder.encode(count_interval))
+
+    bits.extend(encoder.finish())
+
+    return tuple(bits)
+
+def decode(next_counts, bits, end=None, length=None, precision=64,
+           verbose=False):
+    """
+    Decode bits produced by a fixed-precision range coder using the supplied
+    "next counts" function, which finds the next symbol given a RangeDecoder
+    and the context, narrowing the decoder down to the intervals of counts of
+    the symbol. Decoding ends after a specified end symbol or number of
+    symbols.
+    """
+
+    assert(end is not None or length is not None)
+
+    decoder = RangeDecoder(bits, precision)
+    sequence = []
+
+    while length is None or len(sequence) < length:
+        symbol = next_counts(decoder, tuple(sequence))
+        if verbose: print(symbol)
+        sequence.append(symbol)
+
+        if symbol == end:
+            break
+
+    return tuple(sequence)
@@ -2,11 +2,17 @@ import collections
 
 import sympy
 
+from pysteg.coding.interval import bits2interval
 from pysteg.coding.interval import create_interval
+from pysteg.coding.interval import dyadic_subinterval
+from pysteg.coding.interval import find_ratio
 from pysteg.coding.interval import find_superinterval
+from pysteg.coding.interval import interval2bits
 from pysteg.coding.interval import is_subinterval
+from pysteg.coding.interval import on_backend_change
 from pysteg.coding.interval import random_interval
 from pysteg.coding.interval import select_subinterval
+from pysteg.common.listtools import take
 
 # Result of looking for the next symbol given context and current search
 # interval. The elements of the output tuple are:
@@ -20,31 +26,118 @@ NextSymbolSearchResult = collections.namedtuple("NextSymbolSearchResult",
 
 DecodedSequence = collections.namedtuple("DecodedSequence", "sequence interval")
 
-def decode(next, interval, verbose=False):
+# A symbol generated by a streaming decoder, together with the interval of the
+# output sequence so far and a checkpoint from which decoding can be resumed
+DecodedSymbol = collections.namedtuple("DecodedSymbol",
+    "symbol interval checkpoint")
+
+# Checkpoints of the streaming decoders -- the output sequence so far and the
+# search intervals used to find the next symbol (see deep_decode for the
+# meaning of ir and irs)
+DecodeCheckpoint = collections.namedtuple("DecodeCheckpoint",
+    "sequence ssi")
+DeepDecodeCheckpoint = collections.namedtuple("DeepDecodeCheckpoint",
+    "sequence ir irs")
+
+def decode(next, interval, precision=None, verbose=False):
     """
     Decode an interval using the supplied "next token" function. Decoding ends
     when interval corresponding to the output sequence is the smallest
-    superinterval of the input interval.
+    superinterval of the input interval. Codes of IncrementalEncoder with a
+    given precision are decoded with the same precision.
     """
 
-    sequence = []
-    search_result = next(interval, tuple(sequence))
+    sequence = ()
+
+    for decoded in iter_decode(next, interval, precision=precision,
+                               verbose=verbose):
+        (sequence, output_interval) = (decoded.checkpoint.sequence,
+                                       decoded.interval)
+
+    return DecodedSequence(sequence, output_interval)
+
+def iter_decode(next, interval, checkpoint=None, precision=None,
+                verbose=False):
+    """
+    Generate the symbols of decode one by one as DecodedSymbol tuples.
+    Decoding can be resumed from the checkpoint of any of them, given the same
+    input interval.
+    """
+
+    if checkpoint is None:
+        (sequence, ssi) = ((), interval)
+    else:
+        (sequence, ssi) = checkpoint
+
+    def search(ssi, sequence):
+        """Find the next symbol given the input as a ratio of the output."""
+
+        if precision is not None:
+            ssi = _kept_search_interval(interval, ssi, precision)
+            if ssi is None:
+                return None
+
+        return next(ssi, sequence)
+
+    search_result = search(ssi, sequence)
 
     while search_result is not None:
         if verbose: print(search_result.symbol)
-        sequence.append(search_result.symbol)
+        sequence += (search_result.symbol,)
         output_interval = find_superinterval(interval, search_result.ssi)
-        search_result = next(search_result.ssi, tuple(sequence))
 
-    return DecodedSequence(tuple(sequence), output_interval)
+        yield DecodedSymbol(search_result.symbol, output_interval,
+                            DecodeCheckpoint(sequence, search_result.ssi))
+
+        search_result = search(search_result.ssi, sequence)
 
-def deep_decode(next, i, end=None, seed=None, verbose=False):
+def _kept_search_interval(interval, ssi, precision):
+    """
+    Return the input interval as a ratio of the interval kept by an
+    IncrementalEncoder with the given precision after encoding the output
+    sequence, given the input interval as a ratio of the output interval. The
+    settled bits of the output interval are its smallest dyadic superinterval,
+    so the kept interval only depends on the output interval. Return None if
+    the input interval is not within the kept interval.
+    """
+
+    output_interval = find_superinterval(interval, ssi)
+    settled = bits2interval(interval2bits(output_interval, "super"))
+
+    unsettled = find_ratio(output_interval, settled)
+    kept = find_ratio(dyadic_subinterval(unsettled, precision), unsettled)
+
+    if not is_subinterval(ssi, kept):
+        return None
+
+    return find_ratio(ssi, kept)
+
+def deep_decode(next, i, end=None, seed=None, rng=None, verbose=False):
     """
     Decode an interval using a randomly chosen refinement of the input interval
     and the supplied "next token" function. The input interval is refined until
     the interval corresponding to the output sequence is its subinterval. The
     output sequence is optionally continued until a specified end symbol is
     generated.
+
+    Refinements are drawn from the given source of random bits of a session,
+    which they advance. Otherwise every refinement is drawn from a new source,
+    deterministic if a seed is given.
+    """
+
+    for decoded in iter_deep_decode(next, i, end=end, seed=seed, rng=rng,
+                                    verbose=verbose):
+        pass
+
+    return DecodedSequence(decoded.checkpoint.sequence, decoded.interval)
+
+def iter_deep_decode(next, i, end=None, seed=None, rng=None,
+                     checkpoint=None, verbose=False):
+    """
+    Generate the symbols of deep_decode one by one as DecodedSymbol tuples.
+    Decoding can be resumed from the checkpoint of any of them, given the same
+    input interval. The checkpoint does not include the state of the source of
+    random bits.
     """
 
     # i   - actual input interval
@@ -56,28 +149,40 @@ def deep_decode(next, i, end=None, seed=None, verbose=False):
     # Number of random bits of refinement
     n = 100
 
-    # Initial refined input intervals
-    ir = i
-    irs = i
+    if checkpoint is None:
+        # Initial refined input intervals
+        (output_sequence, ir, irs) = ((), i, i)
+        refine = True
+    else:
+        # The refinement is only needed once the search for the next symbol
+        # with the saved intervals fails
+        (output_sequence, ir, irs) = checkpoint
+        refine = False
 
-    output_sequence = []
+        # The checkpoint might be of the last symbol
+        o = find_superinterval(ir, irs)
+        if is_subinterval(o, i) and (end is None or output_sequence[-1] == end):
+            return
 
     while True:
-        # Refine the input interval by a chosen ratio
-        r = random_interval(n, seed=seed)
-        ir = select_subinterval(ir, r)
-        irs = select_subinterval(irs, r)
+        if refine:
+            # Refine the input interval by a chosen ratio
+            r = random_interval(n, seed=seed, rng=rng)
+            ir = select_subinterval(ir, r)
+            irs = select_subinterval(irs, r)
 
-        if verbose: print("Refined input interval by: " + str(r))
+            if verbose: print("Refined input interval by: " + str(r))
+
+        refine = True
 
         # Search for the next symbol
-        search_result = next(irs, tuple(output_sequence))
+        search_result = next(irs, output_sequence)
 
         while search_result is not None:
             # The search procedure gives us the next symbol and the refined
             # input interval scaled inside the current output interval
             (symbol, irs) = (search_result.symbol, search_result.ssi)
-            output_sequence.append(symbol)
+            output_sequence += (symbol,)
 
             # Calculate the current output interval using the refined input
             # interval scaled to it and the knowledge of actual refined input
@@ -86,13 +191,16 @@ def deep_decode(next, i, end=None, seed=None, verbose=False):
 
             if verbose: print(symbol)
 
+            yield DecodedSymbol(symbol, o,
+                                DeepDecodeCheckpoint(output_sequence, ir, irs))
+
             # Terminate generating the output sequence if the output interval
             # becomes a subinterval of the actual input interval. Optionally
             # wait for generating the end symbol.
             if is_subinterval(o, i) and (end is None or symbol == end):
-                return DecodedSequence(tuple(output_sequence), o)
+                return
 
-            search_result = next(irs, tuple(output_sequence))
+            search_result = next(irs, output_sequence)
 
 def encode(conditional_interval, sequence, verbose=False):
     """
@@ -109,3 +217,245 @@ def encode(conditional_interval, sequence, verbose=False):
         )
 
     return interval
+
+def parallel_encode(conditional_interval, sequence, executor, context_length,
+                    chunksize=1):
+    """
+    Encode a sequence into an exact interval like encode, but find the
+    conditional intervals of all symbols concurrently using an executor from
+    concurrent.futures. They only depend on the symbols, so just their product
+    is computed sequentially, by a tree reduction. Only the given number of the
+    last symbols are passed as the context, e.g. (n-1) for a model of order n.
+
+    Finding the intervals is CPU-bound, so only a process pool gives a speedup.
+    Its "conditional subinterval" function has to be picklable -- use
+    worker_conditional_interval with init_encode_worker as the initialiser of
+    the pool, which opens a copy of the model in each worker.
+    """
+
+    symbols = tuple(sequence)
+
+    conditional = executor.map(
+        conditional_interval, symbols,
+        (take(symbols[:i], -context_length) for i in range(len(symbols))),
+        chunksize=chunksize
+    )
+
+    return reduce_intervals(tuple(conditional))
+
+def init_encode_worker(model):
+    """
+    Set the model used by worker_conditional_interval in a worker process. The
+    model has to provide a copy method, like BinDBLM, opening a separate copy,
+    since forked workers would share its open files otherwise.
+    """
+    global _encode_model
+    _encode_model = model.copy()
+
+def worker_conditional_interval(symbol, context):
+    """Return the conditional interval of a symbol from the worker's model."""
+    return _encode_model.conditional_interval(symbol, context)
+
+def reduce_intervals(ratios):
+    """
+    Return the interval obtained by selecting subintervals of [0,1) according to
+    a sequence of ratios, one after another. Since selecting subintervals is
+    associative, neighbouring ratios are combined in a balanced tree, so that
+    the rationals multiplied at each level are of similar size.
+    """
+
+    if len(ratios) == 0:
+        return create_interval(0,1)
+
+    while len(ratios) > 1:
+        ratios = tuple(select_subinterval(ratios[i], ratios[i+1])
+                       if i+1 < len(ratios) else ratios[i]
+                       for i in range(0, len(ratios), 2))
+
+    return ratios[0]
+
+class _TrieNode:
+    """Node of an EncodingTrie -- a cached prefix ending with a symbol."""
+
+    __slots__ = ("symbol", "interval", "parent", "children")
+
+    def __init__(self, symbol, interval, parent):
+        self.symbol = symbol
+        self.interval = interval
+        self.parent = parent
+        self.children = {}
+
+class EncodingTrie:
+    """
+    Encoder caching the intervals of encoded prefixes in a trie of symbols, so
+    that encoding a sequence resumes from its longest cached prefix. The number
+    of cached prefixes is bounded and the least recently used ones are evicted.
+
+    Every use of a prefix also uses all of its own prefixes, which are marked as
+    used after it. So a prefix is always used more recently than its
+    extensions and only leaves of the trie are evicted.
+
+    The trie is cleared when the backend of the intervals is changed.
+    """
+
+    def __init__(self, conditional_interval, max_nodes=100000):
+        assert(max_nodes > 0)
+
+        self.conditional_interval = conditional_interval
+        self.max_nodes = max_nodes
+
+        self.clear()
+        on_backend_change(self.clear)
+
+        # Numbers of symbols whose conditional intervals were reused from the
+        # cache or computed
+        self.reused = 0
+        self.computed = 0
+
+    def clear(self):
+        """Remove all cached prefixes."""
+
+        self.root = _TrieNode(None, create_interval(0,1), None)
+
+        # Nodes other than the root in the order of their last use
+        self.nodes = collections.OrderedDict()
+
+    def encode(self, sequence):
+        """Encode a sequence into an exact interval like encode."""
+
+        path = []
+        node = self.root
+
+        # Follow the longest cached prefix
+        for symbol in sequence:
+            if symbol not in node.children:
+                break
+
+            node = node.children[symbol]
+            path.append(node)
+
+        self.reused += len(path)
+        self.computed += len(sequence) - len(path)
+
+        # Encode the rest of the sequence
+        for i in range(len(path), len(sequence)):
+            interval = select_subinterval(
+                node.interval,
+                self.conditional_interval(sequence[i], sequence[:i])
+            )
+
+            node.children[sequence[i]] = _TrieNode(sequence[i], interval, node)
+            node = node.children[sequence[i]]
+            path.append(node)
+
+        for n in reversed(path):
+            self.nodes[n] = None
+            self.nodes.move_to_end(n)
+
+        while len(self.nodes) > self.max_nodes:
+            (leaf, _) = self.nodes.popitem(last=False)
+            del leaf.parent.children[leaf.symbol]
+
+        return node.interval
+
+class IncrementalEncoder:
+    """
+    Encoder of a sequence into bits, which are emitted as soon as they are
+    settled. The leading bits of the smallest dyadic superinterval of the
+    current interval are shared by the bits of any of its subintervals in
+    both modes of interval2bits. They are emitted and only the current interval
+    as a ratio of their dyadic interval is kept. Only a given number of the
+    last symbols are kept as the context, e.g. (n-1) for a model of order n.
+
+    The exact kept interval has the product of the denominators of all
+    conditional intervals as its denominator. With a given precision, the kept
+    interval is replaced by its dyadic_subinterval after each step instead, so
+    its denominator stays within the precision plus the bits which are not
+    settled yet. The code has to be decoded by decode with the same precision,
+    which replaces the intervals in the same way. Only "sub" mode termination
+    is supported, since "super" mode codes are decoded by deep_decode.
+    """
+
+    def __init__(self, conditional_interval, context_length, precision=None):
+        assert(context_length >= 0)
+
+        self.conditional_interval = conditional_interval
+        self.context_length = context_length
+        self.precision = precision
+
+        self.interval = create_interval(0,1)
+        self.context = collections.deque(maxlen=context_length)
+
+    def encode(self, symbol):
+        """Encode the next symbol. Return the bits settled by this step."""
+
+        self.interval = select_subinterval(
+            self.interval,
+            self.conditional_interval(symbol, tuple(self.context))
+        )
+
+        self.context.append(symbol)
+
+        bits = interval2bits(self.interval, "super")
+
+        if len(bits) > 0:
+            self.interval = find_ratio(self.interval, bits2interval(bits))
+
+        if self.precision is not None:
+            self.interval = dyadic_subinterval(self.interval, self.precision)
+
+        return bits
+
+    def finish(self, mode):
+        """
+        Terminate the code with the bits of the smallest superinterval or the
+        largest subinterval of the interval of the sequence, as interval2bits.
+        Return the bits settled by this step.
+        """
+
+        assert(self.precision is None or mode == "sub")
+
+        return interval2bits(self.interval, mode)
+
+def stream_encode(conditional_interval, symbols, mode, context_length,
+                  precision=None, verbose=False):
+    """
+    Encode symbols taken from an iterator into bits using the supplied
+    "conditional subinterval" function, generating each bit as soon as it is
+    settled. The bits are the same as interval2bits of the encoded interval if
+    the function only depends on the given number of the last symbols. With a
+    given precision, memory stays bounded and the bits are decoded by decode
+    with the same precision, see IncrementalEncoder.
+    """
+
+    encoder = IncrementalEncoder(conditional_interval, context_length,
+                                 precision)
+
+    for symbol in symbols:
+        if verbose: print(symbol)
+        yield from encoder.encode(symbol)
+
+    yield from encoder.finish(mode)
+
+def batch_encode(conditional_intervals, sequences):
+    """
+    Encode many sequences into exact intervals using the supplied "conditional
+    subintervals" function, which takes a sequence of (symbol, context) pairs
+    and returns their conditional subintervals.
+    """
+
+    pairs = tuple((sequence[i], sequence[:i])
+                  for sequence in sequences for i in range(len(sequence)))
+    conditional = iter(conditional_intervals(pairs))
+
+    intervals = []
+
+    for sequence in sequences:
+        interval = create_interval(0,1)
+
+        for i in range(len(sequence)):
+            interval = select_subinterval(interval, next(conditional))
+
+        intervals.append(interval)
+
+    return tuple(intervals)
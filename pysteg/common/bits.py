@@ -0,0 +1,121 @@
+class Bits:
+    """
+    Immutable sequence of bits packed into a single non-negative integer. The
+    first bit is the most significant bit of the value, so bits read as the
+    binary digits of the numerator of a dyadic fraction.
+
+    Bits can be created from any iterable of 0 and 1 and behave as a sequence of
+    them, comparing equal to the tuple or list of the same bits. XOR, slicing,
+    concatenation and cycling are done on the whole value at once.
+    """
+
+    __slots__ = ("value", "length", "_hash")
+
+    def __init__(self, bits=()):
+        """Pack an iterable of 0 and 1."""
+
+        if isinstance(bits, Bits):
+            (self.value, self.length) = (bits.value, bits.length)
+            return
+
+        bits = tuple(bits)
+
+        assert(all(bit in (0,1) for bit in bits))
+
+        digits = "".join("1" if bit else "0" for bit in bits)
+
+        self.value = int(digits or "0", 2)
+        self.length = len(digits)
+
+    @classmethod
+    def from_int(cls, value, length):
+        """Return the length bits of the binary representation of a value."""
+
+        assert(0 <= value < 1 << length)
+
+        bits = cls.__new__(cls)
+        (bits.value, bits.length) = (value, length)
+
+        return bits
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        if self.length > 0:
+            yield from map(int, format(self.value, "0{}b".format(self.length)))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self.length)
+
+            if step != 1:
+                return Bits(tuple(self)[key])
+
+            length = max(stop - start, 0)
+            value = (self.value >> (self.length - start - length)) & (
+                (1 << length) - 1)
+
+            return Bits.from_int(value, length)
+
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("Bits index out of range.")
+
+        return (self.value >> (self.length - key - 1)) & 1
+
+    def __add__(self, other):
+        other = Bits(other)
+        return Bits.from_int((self.value << other.length) | other.value,
+                             self.length + other.length)
+
+    def __radd__(self, other):
+        return Bits(other) + self
+
+    def __xor__(self, other):
+        other = Bits(other)
+
+        assert(self.length == other.length)
+
+        return Bits.from_int(self.value ^ other.value, self.length)
+
+    __rxor__ = __xor__
+
+    def __eq__(self, other):
+        # Bits equal the tuples and lists of the same bits which they replace
+        if isinstance(other, (tuple, list)):
+            return tuple(self) == tuple(other)
+        if not isinstance(other, Bits):
+            return NotImplemented
+        return (self.value, self.length) == (other.value, other.length)
+
+    def __hash__(self):
+        # Equal to the hash of the tuple of bits, since they compare equal. The
+        # bits are only unpacked for the first hash of the immutable value.
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(tuple(self))
+            return self._hash
+
+    def __repr__(self):
+        return "Bits('{}')".format("".join(map(str, self)))
+
+    def cycle(self, length):
+        """Repeat the bits as many times as needed to get length bits."""
+
+        assert(self.length > 0 or length == 0)
+
+        if length == 0:
+            return Bits()
+
+        repeats = -(-length // self.length)
+
+        total = self.length * repeats
+
+        # Multiplying by the sum of 2^(self.length*i) for i < repeats places a
+        # copy of the value in each block of self.length bits
+        blocks = ((1 << total) - 1) // ((1 << self.length) - 1)
+
+        return Bits.from_int((self.value * blocks) >> (total - length), length)
@@ -1,40 +1,101 @@
-import itertools
-import operator
+import os
 import random
 
+from pysteg.common.bits import Bits
+
 class KeyTooShortError(Exception):
     pass
 
-def random_bits(length, seed=None):
+class SystemRNG:
+    """
+    Cryptographically secure source of random bits. Bits are read from
+    os.urandom() in bulk, a whole request at a time.
+    """
+
+    def bits(self, length):
+        """Return packed random bits."""
+
+        nbytes = -(-length // 8)
+        value = int.from_bytes(os.urandom(nbytes), "big")
+
+        return Bits.from_int(value >> (8*nbytes - length), length)
+
+    def child(self, i):
+        """
+        Return an independent stream of bits for the i-th parallel worker. All
+        streams of a cryptographic source are independent anyway.
+        """
+        return self
+
+class SeededRNG:
+    """
+    Deterministic source of random bits derived from a seed, provided for
+    analysing the system deterministically. Each session should create its own
+    source, so that concurrent sessions do not affect each other.
+
+    Bits are drawn one by one, in the same order as from the random module
+    seeded with the same seed.
     """
-    Return a sequence of cryptographically secure random bits, i.e. generated
-    using the os.urandom() function. Optionally generate them using a specific
-    seed - this option is provided for analysing the system deterministically.
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def bits(self, length):
+        """Return packed random bits."""
+        return Bits(self.random.randrange(2) for i in range(length))
+
+    def child(self, i):
+        """
+        Return an independent deterministic stream of bits for the i-th
+        parallel worker, derived from the seed and i only.
+        """
+        return SeededRNG("{}/{}".format(self.seed, i))
+
+def make_rng(seed=None):
+    """
+    Create a source of random bits for a session - a deterministic one if a seed
+    is given and a cryptographically secure one otherwise.
     """
 
     if seed is None:
-        rng = random.SystemRandom()
+        return SystemRNG()
     else:
-        rng = random
-        random.seed(seed)
+        return SeededRNG(seed)
 
-    return tuple(rng.randrange(2) for i in range(length))
+def random_bits(length, seed=None, rng=None):
+    """
+    Return packed cryptographically secure random bits, i.e. generated using the
+    os.urandom() function. Optionally generate them using a specific seed - this
+    option is provided for analysing the system deterministically. The bits are
+    drawn from a new source unless a source of a session is given.
+    """
+
+    if rng is None:
+        rng = make_rng(seed)
+
+    return rng.bits(length)
 
 def encrypt(plaintext, key, strict=False, verbose=False):
     """
-    Encrypt a plaintext bit sequence using a key bit sequence.
+    Encrypt a plaintext bit sequence using a key bit sequence. Return packed
+    bits.
 
     In strict mode, the key is used as a one-time pad and an exception is thrown
     if the key is shorter than plaintext.
 
-    In non-strict mode, the key is cycled to create a simple stream cipher.
+    In non-strict mode, the key is cycled to create a simple stream cipher. An
+    empty key cannot be cycled, so an exception is thrown in both modes if the
+    plaintext is not empty.
     """
 
     if len(key) < len(plaintext):
         if verbose: print("Key too short for a one-time pad cipher!")
-        if strict: raise KeyTooShortError()
+        if strict or len(key) == 0: raise KeyTooShortError()
+
+    (plaintext, key) = (Bits(plaintext), Bits(key))
 
-    return tuple(map(operator.xor, plaintext, itertools.cycle(key)))
+    return plaintext ^ key.cycle(len(plaintext))
 
 def decrypt(ciphertext, key):
     """
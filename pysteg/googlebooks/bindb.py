@@ -1,20 +1,78 @@
+import array
+import atexit
+import bisect
 import collections
+import concurrent.futures
 import functools
+import hashlib
+import heapq
 import itertools
 import math
+import mmap
 import os
+import sqlite3
 import struct
-import sympy
+import threading
+import time
 
 from pysteg.common.itertools import reject
 from pysteg.common.listtools import take
+from pysteg.coding.interval import Interval
 from pysteg.coding.interval import create_interval
 from pysteg.coding.interval import find_ratio
+from pysteg.coding.interval import on_backend_change
+from pysteg.coding.interval import rational
 from pysteg.coding.interval import select_subinterval
+from pysteg.coding.range_coder import CountInterval
 from pysteg.coding.rational_ac import NextSymbolSearchResult
 
 BinDBLine = collections.namedtuple('BinDBLine', 'ngram count')
 TokenCount = collections.namedtuple('TokenCount', 'token b l')
+TokenProbability = collections.namedtuple('TokenProbability', 'token p')
+
+# Translation of a batch of token strings -- arrays of token indices (int32, 0
+# if not found), validity flags (1 if found) and partitions given as positions
+# in the partition names of the index (uint16, 0 if not found)
+TokenBatch = collections.namedtuple('TokenBatch', 'indices valid partitions')
+ModelParameters = collections.namedtuple('ModelParameters',
+    'n_max start end beta gamma offset count_order')
+
+# Statistics of a context stored in the header of its block in a top-k table:
+#
+# first             - line number of the first listed successor
+# successors        - number of all successors of the context
+# successors_count  - sum of counts of all successors of the context
+# lower_order_count - sum of counts of all successors of the context shortened
+#                     by its first token, i.e. the count which is rejected when
+#                     backing off from the context
+TopKStats = collections.namedtuple('TopKStats',
+    'first successors successors_count lower_order_count')
+
+# Default search strategies of BinDBLM._bs for each mode. When the first match
+# is already known, the last one is usually very close to it.
+BS_DEFAULT_POLICY = {"first": "bisect", "last": "gallop"}
+
+# Pseudo-tokens of the header lines of a context block in a top-k table
+TOPK_SUCCESSORS = -1
+TOPK_SUCCESSORS_COUNT = -2
+TOPK_LOWER_ORDER_COUNT = -3
+
+# Name of the file storing the coding order of the successors of contexts in a
+# directory of BinDB tables
+CODING_ORDER_FILE = "coding-order"
+
+# Kinds of calls recorded in a query trace
+TRACE_CONDITIONAL_INTERVAL = 0
+TRACE_NEXT = 1
+
+# A call recorded in a query trace -- its kind, the queried or found token (None
+# if no token was found), the context, the levels of the conditional
+# probability tree looked up during the call and the duration of the call in
+# seconds
+TraceRecord = collections.namedtuple('TraceRecord',
+    'kind token context levels duration')
+TraceLevel = collections.namedtuple('TraceLevel',
+    'context backed_off duration')
 
 class BinDBIndex:
     """
@@ -44,6 +102,11 @@ class BinDBIndex:
 
         self.index_tuple = tuple(index_list)
 
+        self.partition_names = tuple(sorted(set(
+            p for (i, p) in self.index_dict.values())))
+        self._partition_ids = dict((p, j) for (j, p) in
+                                   enumerate(self.partition_names))
+
     def i2s(self, i):
         """Return the string of a token given its index."""
         return self.index_tuple[i-1]
@@ -56,6 +119,213 @@ class BinDBIndex:
         """Return the partition of a token given its string."""
         return self.index_dict[t][1]
 
+    def translate_batch(self, strings):
+        """
+        Translate a batch of token strings to their indices and partitions in a
+        single call. Return a TokenBatch, tokens which are not in the index are
+        marked as invalid instead of raising an error.
+        """
+
+        entries = list(map(self.index_dict.get, strings))
+
+        indices = array.array("i", [0 if e is None else e[0]
+                                    for e in entries])
+        valid = array.array("B", [e is not None for e in entries])
+        partitions = array.array("H", [0 if e is None else
+                                       self._partition_ids[e[1]]
+                                       for e in entries])
+
+        return TokenBatch(indices, valid, partitions)
+
+# Format of the binary index file header -- a magic string, the vocabulary size,
+# the number of partitions, the number of slots of the hash table and the
+# positions of the sections of the file
+_BINARY_INDEX_MAGIC = b"BINDBIX1"
+_BINARY_INDEX_HEADER = struct.Struct("<8sqqqqqqq")
+
+def _binary_index_hash(s):
+    """Hash of the UTF-8 bytes of a token string, stable between processes."""
+    return int.from_bytes(hashlib.blake2b(s, digest_size=8).digest(), "little")
+
+def write_binary_index(path, index):
+    """
+    Save an index to a binary index file, which can be memory-mapped by
+    BinDBBinaryIndex.
+    """
+
+    partitions = index.translate_batch(index.index_tuple).partitions
+
+    write_binary_index_tokens(path, index.index_tuple, index.partition_names,
+                              partitions)
+
+def write_binary_index_tokens(path, tokens, partition_names, partitions):
+    """
+    Save strings of tokens, ordered by their indices starting from 1, to a
+    binary index file. Partitions of the tokens are given as positions of their
+    names in partition_names.
+
+    After the header, the file consists of 4 sections:
+
+    1. offsets of the strings of tokens and of partition names in the blob
+    2. open addressing hash table of token indices (0 for empty slots), keyed
+       by the hashes of their strings
+    3. partitions of the tokens, as the positions of their names
+    4. blob of concatenated UTF-8 strings of the tokens and partition names
+    """
+
+    size = len(tokens)
+
+    strings = [t.encode("utf-8") for t in tokens]
+    strings.extend(p.encode("utf-8") for p in partition_names)
+
+    offsets = array.array("Q", [0])
+    for t in strings:
+        offsets.append(offsets[-1] + len(t))
+
+    # The hash table is at most half full, so that the probe sequences are short
+    slots = 2
+    while slots < 2*size:
+        slots *= 2
+
+    hash_table = array.array("i", bytes(4*slots))
+    for i in range(1, size+1):
+        slot = _binary_index_hash(strings[i-1]) & (slots-1)
+        while hash_table[slot] != 0:
+            slot = (slot+1) & (slots-1)
+        hash_table[slot] = i
+
+    partitions = array.array("H", partitions)
+
+    # Sections follow each other, sizes of the arrays keep them aligned
+    offsets_pos = _BINARY_INDEX_HEADER.size
+    hash_pos = offsets_pos + 8*len(offsets)
+    partitions_pos = hash_pos + 4*slots
+    blob_pos = partitions_pos + 2*size
+
+    with open(path, "wb") as f:
+        f.write(_BINARY_INDEX_HEADER.pack(
+            _BINARY_INDEX_MAGIC, size, len(partition_names), slots,
+            offsets_pos, hash_pos, partitions_pos, blob_pos
+        ))
+        offsets.tofile(f)
+        hash_table.tofile(f)
+        partitions.tofile(f)
+        for t in strings:
+            f.write(t)
+
+class BinDBBinaryIndex:
+    """
+    Binary version of BinDBIndex, memory-mapped from a file created by
+    write_binary_index. Nothing is parsed when the index is opened, so it can be
+    used straight away and its pages are shared by all processes using it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = _BINARY_INDEX_HEADER.unpack_from(self.mmap)
+
+        if header[0] != _BINARY_INDEX_MAGIC:
+            raise ValueError("{} is not a binary index file.".format(path))
+
+        (self.size, partitions, self.slots, offsets_pos, hash_pos,
+         partitions_pos, self.blob_pos) = header[1:]
+
+        view = memoryview(self.mmap)
+        self.offsets = view[offsets_pos:hash_pos].cast("Q")
+        self.hash_table = view[hash_pos:partitions_pos].cast("i")
+        self.partitions = view[partitions_pos:self.blob_pos].cast("H")
+
+        self.partition_names = tuple(self._string(self.size + j)
+                                     for j in range(partitions))
+
+    def __del__(self):
+        # The memory map cannot be closed while its memory is exported
+        for a in ("offsets", "hash_table", "partitions"):
+            if hasattr(self, a):
+                getattr(self, a).release()
+
+        if hasattr(self, "mmap"):
+            self.mmap.close()
+
+    def __getstate__(self):
+        # The memory map cannot be pickled, so the index is mapped again when
+        # unpickled, e.g. in worker processes
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def _bytes(self, j):
+        """Return the UTF-8 bytes of the j'th (0-indexed) string of the blob."""
+        return self.mmap[self.blob_pos + self.offsets[j]:
+                         self.blob_pos + self.offsets[j+1]]
+
+    def _string(self, j):
+        """Return the j'th (0-indexed) string of the blob."""
+        return self._bytes(j).decode("utf-8")
+
+    def _find(self, t):
+        """Return the index of a token given its string or 0 if not found."""
+
+        s = t.encode("utf-8")
+        slot = _binary_index_hash(s) & (self.slots-1)
+
+        while True:
+            i = self.hash_table[slot]
+            if i == 0 or self._bytes(i-1) == s:
+                return i
+            slot = (slot+1) & (self.slots-1)
+
+    def i2s(self, i):
+        """Return the string of a token given its index."""
+        # Indexing a range behaves like indexing the tuple of BinDBIndex,
+        # including negative and out of range indices
+        return self._string(range(self.size)[i-1])
+
+    def s2i(self, t):
+        """Return the index of a token given its string."""
+
+        i = self._find(t)
+
+        if i == 0:
+            raise KeyError(t)
+
+        return i
+
+    def s2p(self, t):
+        """Return the partition of a token given its string."""
+        return self.partition_names[self.partitions[self.s2i(t)-1]]
+
+    def translate_batch(self, strings):
+        """
+        Translate a batch of token strings to their indices and partitions in a
+        single call. Return a TokenBatch, tokens which are not in the index are
+        marked as invalid instead of raising an error.
+        """
+
+        indices = array.array("i", map(self._find, strings))
+        valid = array.array("B", [i != 0 for i in indices])
+        partitions = array.array("H", [self.partitions[i-1] if i != 0 else 0
+                                       for i in indices])
+
+        return TokenBatch(indices, valid, partitions)
+
+def load_index(path):
+    """Load a text or binary index file, depending on its format."""
+
+    with open(path, "rb") as f:
+        binary = f.read(len(_BINARY_INDEX_MAGIC)) == _BINARY_INDEX_MAGIC
+
+    if binary:
+        return BinDBBinaryIndex(path)
+
+    with open(path, "r") as f:
+        return BinDBIndex(f)
+
 class BinDBLM:
     """
     A BinDB-based language model. Gives conditional probability intervals and
@@ -63,11 +333,27 @@ class BinDBLM:
     be around.
     """
 
-    def __init__(self, bindb_dir, n_max, start, end, beta, gamma, offset):
+    def __init__(self, bindb_dir, n_max, start, end, beta, gamma, offset,
+                 next_search="float", topk=False, coding_order="token",
+                 prefetch_contexts=0, prefetch_threads=2, warm_cache=None,
+                 interval_cache=None, interval_cache_size=1000000,
+                 bs_policy=None, trace=None):
         # Only models of order 2 or more are allowed -- this is because sentence
         # continuity needs to be maintained
         assert(n_max > 1)
 
+        # Arguments of the model, used to open a separate copy of it when it is
+        # pickled, see __getstate__
+        self._arguments = dict(
+            bindb_dir=bindb_dir, n_max=n_max, start=start, end=end, beta=beta,
+            gamma=gamma, offset=offset, next_search=next_search, topk=topk,
+            coding_order=coding_order, prefetch_contexts=prefetch_contexts,
+            prefetch_threads=prefetch_threads, warm_cache=warm_cache,
+            interval_cache=interval_cache,
+            interval_cache_size=interval_cache_size, bs_policy=bs_policy,
+            trace=trace
+        )
+
         self.n_max = n_max          # Order of the model
         self.start = start          # Indices of the _START_ and _END_ tokens
         self.end = end
@@ -78,26 +364,217 @@ class BinDBLM:
         self.offset = offset        # Offset by which all counts are reduced to
                                     # shift the probability away from the tail
 
+        # Strategy of locating the next token in the cumulative counts. "exact"
+        # always scales the search interval to the window of integer counts
+        # and looks the window up, "float" first guesses the token using a
+        # floating point approximation of the scaled interval and only falls
+        # back to the exact search if the guess cannot be verified. Both
+        # strategies give identical results.
+        assert(next_search in ("exact", "float"))
+        self.next_search = next_search
+
         paths = dict((n, os.path.join(bindb_dir, "{n}gram".format(**locals())))
                      for n in range(1,n_max+1))
 
-        self.f = dict((n, open(path, "rb")) for n, path in paths.items())
+        # Search strategies keyed by (n, mode) of the search, defaulting to
+        # BS_DEFAULT_POLICY, and the number of searches and probes made. The
+        # counters are updated under a lock, since prefetching threads search
+        # too.
+        self.bs_policy = {} if bs_policy is None else bs_policy
+        self.bs_searches = collections.Counter()
+        self.bs_probes = collections.Counter()
+        self._bs_lock = threading.Lock()
+
+        # Files are opened separately for every thread that reads them, see the
+        # f property
+        self.paths = paths
+        self._local = threading.local()
+        self._files = []
+        self._files_lock = threading.Lock()
 
         self.size = dict((n, int(os.path.getsize(path)/line_size(n)))
                          for n, path in paths.items())
 
+        # Order in which the successors of a context are laid out in the
+        # conditional probability intervals. In "token" order they follow the
+        # token indices of the BinDB tables. In "count" order they are sorted by
+        # descending counts as listed in complete top-k tables, so that scans
+        # find frequent tokens early. Only directories marked by
+        # create_topk_index.py --count-order have complete top-k tables.
+        assert(coding_order in ("token", "count"))
+
+        if coding_order == "count" and read_coding_order(bindb_dir) != "count":
+            raise ValueError("BinDB tables in {} have no complete top-k tables "
+                             "for the count coding order.".format(bindb_dir))
+
+        self.count_order = coding_order == "count"
+
+        # Optional top-k tables with the most frequent successors of every
+        # context, created by the create_topk_index.py script
+        self.topk = topk
+        self.topk_paths = {}
+        self.topk_size = {}
+
+        if topk or self.count_order:
+            self.topk_paths = dict((n, path + "-topk")
+                                   for n, path in paths.items())
+
+            self.topk_size = dict(
+                (n, int(os.path.getsize(path)/line_size(n)))
+                for n, path in self.topk_paths.items()
+            )
+
         # A pseudo-token for back-off
         self.backoff = self.size[1] + 1
 
+        # Optional read-only cache of the distributions of frequent contexts,
+        # created by the create_warm_cache.py script
+        if warm_cache is not None:
+            self.warm_cache = BinDBWarmCache(warm_cache)
+
+            if self.warm_cache.fingerprint != self.fingerprint():
+                raise ValueError("Warm cache {} was created for a different "
+                                 "language model.".format(warm_cache))
+        else:
+            self.warm_cache = None
+
+        # Optional speculative prefetching of the distributions of the most
+        # probable next contexts when searching for the next token
+        if prefetch_contexts > 0:
+            self.prefetcher = BinDBPrefetcher(self, prefetch_contexts,
+                                              prefetch_threads)
+        else:
+            self.prefetcher = None
+
+        # Optional persistent cache of conditional probability intervals shared
+        # between runs of models with the same fingerprint
+        if interval_cache is not None:
+            self.interval_cache = BinDBIntervalCache(
+                interval_cache, self.fingerprint(), interval_cache_size)
+        else:
+            self.interval_cache = None
+
+        # Optional recording of the calls to a query trace file, which can be
+        # replayed with the replay_trace.py script
+        if trace is not None:
+            self.trace = BinDBTraceRecorder(trace)
+        else:
+            self.trace = None
+
     def __del__(self):
-        for f in self.f.values():
+        # The initialisation might have failed before creating the prefetcher
+        if getattr(self, "prefetcher", None) is not None:
+            self.prefetcher.shutdown()
+
+        if getattr(self, "interval_cache", None) is not None:
+            self.interval_cache.close()
+
+        if getattr(self, "trace", None) is not None:
+            self.trace.close()
+
+        for f in itertools.chain(*(f.values() for f in self._files)):
             f.close()
 
-    def _bs(self, n, mgram, imin=1, imax=None, mode="first", ratio=0.5):
+    def __getstate__(self):
+        # Open files and caches cannot be pickled, so a model is pickled as its
+        # arguments and opened again when unpickled, e.g. in worker processes.
+        # Query traces are not written by the copies.
+        return dict(self._arguments, trace=None)
+
+    def __setstate__(self, arguments):
+        self.__init__(**arguments)
+
+    def copy(self):
+        """
+        Return a separate copy of the model with its own files and caches, e.g.
+        for a worker process. Forked workers share the open files of the
+        model, so they cannot use it directly.
+        """
+
+        return type(self)(**self.__getstate__())
+
+    def parameters(self):
+        """Return the parameters which determine the model distributions."""
+        return ModelParameters(self.n_max, self.start, self.end, self.beta,
+                               self.gamma, self.offset, self.count_order)
+
+    def fingerprint(self):
+        """
+        Return a fingerprint of the model -- a hash of its parameters, including
+        the coding order, and of the size and first and last blocks of each
+        table, including the top-k tables used by the model. Only the contents
+        are hashed, so copied tables keep the fingerprint.
+        """
+
+        block_size = 1 << 20
+
+        # The same parameters given as integers or floats give the same model
+        parameters = self.parameters()._replace(beta=float(self.beta),
+                                                gamma=float(self.gamma))
+
+        h = hashlib.sha256(repr(parameters).encode("utf-8"))
+
+        paths = ([self.paths[n] for n in sorted(self.paths)] +
+                 [self.topk_paths[n] for n in sorted(self.topk_paths)])
+
+        for path in paths:
+            size = os.path.getsize(path)
+            h.update(repr((os.path.basename(path), size)).encode("utf-8"))
+
+            with open(path, "rb") as f:
+                h.update(f.read(block_size))
+                f.seek(max(0, size - block_size))
+                h.update(f.read(block_size))
+
+        return h.hexdigest()
+
+    @property
+    def f(self):
+        """
+        Files of the BinDB tables opened for the current thread. Reading a line
+        requires seeking, so threads cannot share the files.
+        """
+
+        if not hasattr(self._local, "f"):
+            self._local.f = dict((n, open(path, "rb"))
+                                 for n, path in self.paths.items())
+
+            with self._files_lock:
+                self._files.append(self._local.f)
+
+        return self._local.f
+
+    @property
+    def topk_f(self):
+        """Files of the top-k tables opened for the current thread."""
+
+        if not hasattr(self._local, "topk_f"):
+            self._local.topk_f = dict((n, open(path, "rb"))
+                                      for n, path in self.topk_paths.items())
+
+            with self._files_lock:
+                self._files.append(self._local.topk_f)
+
+        return self._local.topk_f
+
+    def _bs(self, n, mgram, imin=1, imax=None, mode="first", ratio=0.5,
+            topk=False):
         """
-        Binary search for the first or last ngram with first m tokens equal to
-        the given mgram. The ratio parameter specifies where the midpoint
-        between imin and imax should be located.
+        Search for the first or last ngram with first m tokens equal to the
+        given mgram. Optionally search the top-k table of order n instead of the
+        counts table.
+
+        The search strategy for a table and mode is chosen according to the
+        bs_policy of the model:
+
+        bisect        - binary search, the ratio parameter specifies where the
+                        midpoint between imin and imax should be located
+        gallop        - exponential search from imin followed by binary search,
+                        efficient if the match is close to imin
+        interpolation - interpolation search on the values of the first tokens
+                        followed by binary search, only used in "first" mode
+
+        Top-k tables are always searched with bisection.
         """
 
         assert(mode in ("first", "last"))
@@ -106,15 +583,74 @@ class BinDBLM:
         m = len(mgram)
         assert(m <= n)
 
+        probes = 0
+
         def get_ngram(i):
             """
             Return from the specified table i'th ngram truncated to the size of
             the searched mgram.
             """
-            return read_line(self.f[n], n, i).ngram[:m]
+            nonlocal probes
+            probes += 1
+            return read_line(f, n, i).ngram[:m]
+
+        (f, size) = ((self.topk_f[n], self.topk_size[n]) if topk else
+                     (self.f[n], self.size[n]))
 
         if imax == None:
-            imax = self.size[n]
+            imax = size
+
+        if topk:
+            strategy = "bisect"
+        else:
+            strategy = self.bs_policy.get((n, mode), BS_DEFAULT_POLICY[mode])
+
+        assert(strategy in ("bisect", "gallop", "interpolation"))
+
+        if strategy == "gallop":
+            # Find a small range containing the match by doubling the distance
+            # of probes from imin
+            step = 1
+            if mode == "first":
+                while imin + step - 1 < imax:
+                    if get_ngram(imin + step - 1) < mgram:
+                        (imin, step) = (imin + step, step * 2)
+                    else:
+                        imax = imin + step - 1
+                        break
+            else:
+                while imin + step <= imax:
+                    if get_ngram(imin + step) > mgram:
+                        imax = imin + step - 1
+                        break
+                    else:
+                        (imin, step) = (imin + step, step * 2)
+
+        elif strategy == "interpolation" and mode == "first" and m > 0:
+            def value(ngram):
+                """Value of an ngram based on its first two tokens."""
+                if len(ngram) > 1:
+                    return ngram[0] + ngram[1] / (self.backoff + 1)
+                else:
+                    return ngram[0]
+
+            target = value(mgram)
+            (lo, hi) = (value(get_ngram(imin)), value(get_ngram(imax)))
+
+            # Interpolate while the values differ, but not longer than binary
+            # search would take
+            for i in range(size.bit_length()):
+                if imin >= imax or lo >= hi:
+                    break
+
+                imid = imin + math.floor((target-lo) / (hi-lo) * (imax-imin))
+                imid = min(max(imid, imin), imax-1)
+
+                ngram = get_ngram(imid)
+                if ngram < mgram:
+                    (imin, lo) = (imid + 1, value(ngram))
+                else:
+                    (imax, hi) = (imid, value(ngram))
 
         # Binary search loop with deferred detection of equality to find the
         # first or last match
@@ -132,12 +668,29 @@ class BinDBLM:
                 else:
                     imin = imid
 
-        if get_ngram(imin) == mgram:
+        match = get_ngram(imin) == mgram
+
+        if not topk:
+            with self._bs_lock:
+                self.bs_searches[(n, mode)] += 1
+                self.bs_probes[(n, mode)] += probes
+
+        if match:
             return imin
         else:
             return None
 
-    def _bs_range(self, n, mgram):
+    def bs_statistics(self):
+        """
+        Return a dictionary of (number of searches, average number of probes)
+        tuples keyed by the (n, mode) of the searches.
+        """
+        with self._bs_lock:
+            return dict((key, (self.bs_searches[key],
+                               self.bs_probes[key] / self.bs_searches[key]))
+                        for key in self.bs_searches)
+
+    def _bs_range(self, n, mgram, imin=1):
         """
         Binary search for the range of ngrams with first m tokens equal to the
         given mgram.
@@ -147,7 +700,7 @@ class BinDBLM:
         if len(mgram) == 0:
             return (1, self.size[n])
 
-        ifirst = self._bs(n, mgram, mode="first")
+        ifirst = self._bs(n, mgram, imin=imin, mode="first")
 
         if ifirst is not None:
             # At least one ngram matches the mgram
@@ -156,13 +709,78 @@ class BinDBLM:
         else:
             return None
 
+    def _bs_ranges(self, n, mgrams):
+        """
+        Binary search for the ranges of ngrams matching each of the given
+        mgrams. The mgrams are searched in sorted order, each search starting
+        where the previous match was found, so the table is read front to back.
+        Return a dictionary of ranges (or None) keyed by (n, mgram).
+        """
+
+        ranges = {}
+        imin = 1
+
+        for mgram in sorted(set(mgrams)):
+            ranges[(n, mgram)] = self._bs_range(n, mgram, imin)
+
+            if len(mgram) > 0 and ranges[(n, mgram)] is not None:
+                imin = ranges[(n, mgram)][1]
+
+        return ranges
+
+    def _backoff_count(self, adjusted_accepted_count, real_accepted_count,
+                       total_context_count):
+        """Return the adjusted back-off pseudo-count of a context."""
+
+        leftover_context_count = total_context_count - real_accepted_count
+        backoff_pseudocount = (self.beta * leftover_context_count
+                               + self.gamma * total_context_count)
+        return math.ceil(
+            adjusted_accepted_count/real_accepted_count*backoff_pseudocount
+        )
+
+    def _topk_stats(self, n, context):
+        """
+        Return the statistics of a context stored in the top-k table of order n
+        or None if the context has no successors.
+        """
+
+        i = self._bs(n, context, topk=True)
+
+        if i is None:
+            return None
+
+        header = tuple(read_line(self.topk_f[n], n, i+j) for j in range(3))
+        assert(tuple(l.ngram[-1] for l in header) ==
+               (TOPK_SUCCESSORS, TOPK_SUCCESSORS_COUNT, TOPK_LOWER_ORDER_COUNT))
+
+        return TopKStats(i+3, *(l.count for l in header))
+
+    def count(self, ngram):
+        """Return the count of an ngram or None if it is not in the tables."""
+
+        n = len(ngram)
+        i = self._bs(n, ngram)
+
+        if i is None:
+            return None
+        else:
+            return read_line(self.f[n], n, i).count
+
     def conditional_interval(self, token, context):
         """Return the conditional probability interval of a token."""
 
         # Only use context within the order of the model
         context = take(context, -(self.n_max-1))
 
-        return self._raw_conditional_interval(token, context, None)
+        if self.trace is None:
+            return self._raw_conditional_interval(token, context, None)
+
+        self.trace.begin()
+        interval = self._raw_conditional_interval(token, context, None)
+        self.trace.end(TRACE_CONDITIONAL_INTERVAL, token, context)
+
+        return interval
 
     def next(self, interval, context):
         """Return the next token given current context and interval."""
@@ -170,25 +788,125 @@ class BinDBLM:
         # Only use context within the order of the model
         context = take(context, -(self.n_max-1))
 
-        return self._raw_next(interval, context, None)
+        if self.trace is not None:
+            self.trace.begin()
+
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(context)
+
+        result = self._raw_next(interval, context, None)
+
+        if self.trace is not None:
+            self.trace.end(TRACE_NEXT, 0 if result is None else result.symbol,
+                           context)
+
+        return result
+
+    def conditional_counts(self, token, context):
+        """
+        Return the intervals of integer counts of a token for a range coder,
+        one for each level of the conditional probability tree.
+        """
+
+        # Only use context within the order of the model
+        context = take(context, -(self.n_max-1))
+
+        return self._raw_conditional_counts(token, context, None)
+
+    def next_counts(self, decoder, context):
+        """
+        Return the next token given current context, found by the target counts
+        of a range decoder, which is narrowed down to the intervals of counts of
+        the token.
+        """
+
+        # Only use context within the order of the model
+        (context, backed_off) = (take(context, -(self.n_max-1)), None)
+
+        while True:
+            full_count = self._full_count(context, backed_off)
+            target = decoder.target(full_count)
+
+            token = self._next_in_window(context, backed_off, target, target+1)
+            decoder.decode(CountInterval(token.b, token.l, full_count))
+
+            if token.token != self.backoff:
+                return token.token
+
+            (context, backed_off) = (context[1:], context[0])
+
+    def iter_matching_tokens(self, context, backed_off):
+        """
+        Iterate over the tokens matching a context of length (n-1) at a single
+        level of the conditional probability tree, as TokenCount tuples. Bases
+        and lengths of the intervals of the tokens are in counts, the back-off
+        pseudo-token comes last if back-off is possible. backed_off is the first
+        token of the higher order context, from which the context was
+        backed-off, or None.
+        """
+        return self._iter_matching_tokens(context, backed_off)
+
+    def _matching_tokens(self, context, backed_off):
+        """
+        Return a tuple of tokens matching a context, recording the lookup in the
+        query trace if it is enabled.
+        """
+
+        if self.trace is None:
+            return self._lookup_matching_tokens(context, backed_off)
+
+        start = time.perf_counter()
+        tokens = self._lookup_matching_tokens(context, backed_off)
+        self.trace.level(context, time.perf_counter() - start)
+
+        return tokens
+
+    def _lookup_matching_tokens(self, context, backed_off):
+        """
+        Return a tuple of tokens matching a context, using the warm cache or
+        the distributions prefetched for the next token search if possible.
+        """
+
+        if self.warm_cache is not None:
+            tokens = self.warm_cache.get(context, backed_off)
+            if tokens is not None:
+                return tokens
 
-    def _iter_matching_tokens(self, context, backed_off):
+        if self.prefetcher is not None and backed_off is None:
+            return self.prefetcher.get(context)
+        else:
+            return tuple(self._iter_matching_tokens(context, backed_off))
+
+    def _iter_matching_tokens(self, context, backed_off, ranges=None):
         """
         Iterate over BinDB lines corresponding to ngrams matching a particular
         context of length (n-1), optionally excluding ngrams which would be
         covered by a model one order higher.
+
+        Ranges of ngrams found in advance by _bs_ranges can be supplied to
+        avoid searching for them again.
         """
 
+        def bs_range(n, mgram):
+            """Return a range of ngrams, searching only if not supplied."""
+            if ranges is not None and (n, mgram) in ranges:
+                return ranges[(n, mgram)]
+            else:
+                return self._bs_range(n, mgram)
+
         # At the beginning of a sentence or directly after an _END_ token, the
         # only option is a _START_ token.
-        if ((len(context) == 0 and backed_off is None) or
-            (len(context) > 0 and context[-1] == self.end)):
+        if self._start_only(context, backed_off):
             yield TokenCount(self.start, 0, 1)
             return
 
+        if self.count_order:
+            yield from self._iter_count_ordered_tokens(context, backed_off)
+            return
+
         # Find ngrams matching the context
         n = len(context) + 1
-        ngrams_range = self._bs_range(n, context)
+        ngrams_range = bs_range(n, context)
 
         # If there are no matching ngrams, back-off is the only option
         if ngrams_range is None:
@@ -210,7 +928,7 @@ class BinDBLM:
         else:
             # If we backed-off from a higher order context, do not consider the
             # ngrams which were already covered by the higher order model
-            ograms_range = self._bs_range(n+1, (backed_off,) + context)
+            ograms_range = bs_range(n+1, (backed_off,) + context)
 
             if ograms_range is None:
                 # There are no matching higher order tokens, so no rejects
@@ -256,9 +974,12 @@ class BinDBLM:
 
         # Calculate the back-off pseudo-count
         if n > 1:
-            context_count = read_line(
-                self.f[n-1], n-1, self._bs(n-1, context)
-            ).count
+            if ranges is not None and (n-1, context) in ranges:
+                context_line = ranges[(n-1, context)][0]
+            else:
+                context_line = self._bs(n-1, context)
+
+            context_count = read_line(self.f[n-1], n-1, context_line).count
             total_context_count = context_count - rejected_count
 
             # If there is not a single leave, back-off is the only option
@@ -266,94 +987,1233 @@ class BinDBLM:
                 yield TokenCount(self.backoff, 0, 1)
                 return
 
-            leftover_context_count = total_context_count - real_accepted_count
-            backoff_pseudocount = (self.beta * leftover_context_count
-                                   + self.gamma * total_context_count)
-            adjusted_backoff_pseudocount = math.ceil(
-                adjusted_accepted_count/real_accepted_count*backoff_pseudocount
-            )
             yield TokenCount(self.backoff, adjusted_accepted_count,
-                             adjusted_backoff_pseudocount)
+                             self._backoff_count(adjusted_accepted_count,
+                                                 real_accepted_count,
+                                                 total_context_count))
+
+    def _top_k_level(self, context, backed_off, k):
+        """
+        Return the k most frequent tokens matching a context of length (n-1) at
+        a single level of the conditional probability tree, the full count of
+        this level and the back-off pseudo-count (None if back-off is not
+        possible). The tokens are found by scanning all matching ngrams.
+        """
+
+        tokens = self._matching_tokens(context, backed_off)
+
+        # All unigrams can be covered by the higher order model
+        if len(tokens) == 0:
+            return ((), 1, None)
+
+        last = tokens[-1]
+
+        full_count = last.b + last.l
+        backoff_count = last.l if last.token == self.backoff else None
+
+        top_tokens = heapq.nsmallest(
+            k, (t for t in tokens if t.token != self.backoff and t.l > 0),
+            key=lambda t: (-t.l, t.token)
+        )
+
+        return (tuple(top_tokens), full_count, backoff_count)
 
     @functools.lru_cache(maxsize=8192)
-    def _raw_conditional_interval(self, token, context, backed_off):
-        """Internal version of the conditional probability interval method."""
+    def _indexed_level(self, context, backed_off):
+        """
+        Find the statistics of a context of length (n-1) at a single level of
+        the conditional probability tree using the top-k tables. Return the
+        statistics of the context (None if none of its successors can be
+        accepted), the tokens excluded at this level, the full count of this
+        level and the back-off pseudo-count (None if back-off is not possible).
+
+        The statistics are correct only for counts-consistent tables, i.e. if
+        every ngram of order n+1 has its suffix in the table of order n.
+        """
 
-        match = None
-        backoff_token = None
+        n = len(context) + 1
+        stats = self._topk_stats(n, context)
 
-        for i in self._iter_matching_tokens(context, backed_off):
-            if i.token == token:
-                match = i
-            if i.token == self.backoff:
-                backoff_token = i
-            full_count = i.b + i.l
+        # If there are no matching ngrams, back-off is the only option
+        if stats is None:
+            return (None, (), 1, 1)
 
-        if match is not None:
-            # If the token was found in the ngrams, report its interval
-            return create_interval(match.b, match.l, full_count)
-        elif backoff_token is not None:
-            # Otherwise, back-off the model and report the backed-off interval
-            # within the probability mass assigned to back-off
-            backoff_interval = create_interval(
-                backoff_token.b, backoff_token.l, full_count)
-            backoff_subinterval = self._raw_conditional_interval(
-                token, context[1:], context[0]
-            )
-            return select_subinterval(backoff_interval, backoff_subinterval)
+        # If we backed-off from a higher order context, the ngrams which were
+        # already covered by the higher order model are rejected
+        if backed_off is None:
+            ostats = None
         else:
-            raise Exception('Impossible sentence.')
+            ostats = self._topk_stats(n+1, (backed_off,) + context)
 
-    @functools.lru_cache(maxsize=8192)
-    def _raw_next(self, search_interval, context, backed_off):
-        """Internal version of the next token method."""
+        if ostats is None:
+            rejected = 0
+            rejected_count = 0
+        else:
+            rejected = ostats.successors
+            rejected_count = ostats.lower_order_count
 
-        tokens = tuple(self._iter_matching_tokens(context, backed_off))
+        # Check whether we are directly following a _START_ token
+        sentence_start = ((len(context) > 0 and context[-1] == self.start) or
+                          (len(context) == 0 and backed_off == self.start))
 
-        # Find correct scaled interval
-        full_count = tokens[-1].b + tokens[-1].l
-        base = sympy.floor(search_interval.b * full_count)
-        end = sympy.ceiling((search_interval.b+search_interval.l) * full_count)
-        length = end - base
+        # _START_ tokens are always rejected and _END_ tokens directly after the
+        # _START_ of a sentence, unless already covered by the higher order
+        excluded = (self.start, self.end) if sentence_start else (self.start,)
 
-        def interval_bs(tokens, base, end):
-            """
-            Find using binary search a token whose counts are a superinterval of
-            [base, end].
-            """
-            imin = 0
-            imax = len(tokens)-1
+        counts = {}
+        for token in excluded:
+            count = self.count(context + (token,))
+            if count is not None:
+                counts[token] = count
 
-            while imin <= imax:
-                imid = round((imin+imax)/2)
+        covered = self._covered_tokens(counts, context, backed_off)
 
-                if (tokens[imid].b <= base and
-                    tokens[imid].b + tokens[imid].l >= base + length):
-                    return imid
-                elif tokens[imid].b + tokens[imid].l <= base:
-                    imin = imid + 1
-                else:
-                    imax = imid - 1
+        for (token, count) in counts.items():
+            if token not in covered:
+                rejected += 1
+                rejected_count += count
 
-        i = interval_bs(tokens, base, end)
+        real_accepted_count = stats.successors_count - rejected_count
+        adjusted_accepted_count = (real_accepted_count -
+                                   self.offset*(stats.successors - rejected))
 
-        if i is None:
-            # No token can be found
-            return None
+        # Calculate the back-off pseudo-count
+        if n > 1:
+            # If there is not a single leave, back-off is the only option
+            if real_accepted_count == 0:
+                return (None, excluded, 1, 1)
+
+            total_context_count = self.count(context) - rejected_count
+            backoff_count = self._backoff_count(adjusted_accepted_count,
+                                                real_accepted_count,
+                                                total_context_count)
+            full_count = adjusted_accepted_count + backoff_count
         else:
-            # We have found a token -- standard or back-off
-            token = tokens[i]
-            token_interval = create_interval(token.b, token.l, full_count)
-            scaled_search_interval = find_ratio(search_interval, token_interval)
+            backoff_count = None
+            full_count = adjusted_accepted_count
 
-            if token.token == self.backoff:
-                return self._raw_next(scaled_search_interval, context[1:],
-                                      context[0])
+        return (stats, excluded, full_count, backoff_count)
 
-            else:
-                return NextSymbolSearchResult(token.token,
+    def _covered(self, token, context, backed_off):
+        """
+        Return whether a token following a context is covered by the higher
+        order model, from which the context was backed-off.
+        """
+        return (backed_off is not None and
+                self._bs(len(context)+2, (backed_off,) + context + (token,))
+                is not None)
+
+    def _covered_tokens(self, tokens, context, backed_off):
+        """
+        Return the set of the given tokens following a context, which are
+        covered by the higher order model, from which the context was
+        backed-off. The sorted tokens are matched against the sorted successors
+        of the higher order context in a single merge pass, galloping over the
+        successors which are not among the tokens.
+        """
+
+        tokens = sorted(set(tokens))
+
+        if backed_off is None or len(tokens) == 0:
+            return set()
+
+        n = len(context) + 2
+        ograms_range = self._bs_range(n, (backed_off,) + context)
+
+        if ograms_range is None:
+            return set()
+
+        (i, ilast) = ograms_range
+
+        def successor(i):
+            return read_line(self.f[n], n, i).ngram[-1]
+
+        covered = set()
+
+        for token in tokens:
+            # Find a range [i, j) ending with a successor not below the token
+            # by doubling the distance of probes from the current position
+            step = 1
+            while i+step-1 <= ilast and successor(i+step-1) < token:
+                (i, step) = (i+step, step*2)
+            j = min(i+step-1, ilast+1)
+
+            # Find the first successor not below the token in the range
+            while i < j:
+                imid = (i+j) // 2
+                if successor(imid) < token:
+                    i = imid + 1
+                else:
+                    j = imid
+
+            if i > ilast:
+                break
+
+            if successor(i) == token:
+                covered.add(token)
+
+        return covered
+
+    def _top_k_level_indexed(self, context, backed_off, k):
+        """
+        Indexed version of _top_k_level. Instead of scanning all matching
+        ngrams, the most frequent ones are read from the top-k table and the
+        full count is calculated from the statistics of the context. Bases of
+        the returned tokens are unknown and set to None.
+
+        If the top-k table was created with fewer than k listed successors of
+        the context and they run out before k tokens are accepted, unlisted
+        successors may be more frequent than the successors of lower levels, so
+        all matching ngrams are scanned as in _top_k_level.
+        """
+
+        # At the beginning of a sentence or directly after an _END_ token, the
+        # only option is a _START_ token.
+        if self._start_only(context, backed_off):
+            return ((TokenCount(self.start, 0, 1),), 1, None)
+
+        n = len(context) + 1
+        (stats, excluded, full_count, backoff_count) = self._indexed_level(
+            context, backed_off)
+
+        if stats is None:
+            return ((), full_count, backoff_count)
+
+        # Read the listed successors in the order of descending counts. Tokens
+        # covered by the higher order model are found for a batch of the
+        # successors still needed at once.
+        lines = iter_bindb_file(self.topk_f[n], n, stats.first)
+        lines = itertools.takewhile(lambda l: l.ngram[:-1] == context, lines)
+        listed = itertools.count()
+        candidates = (TokenCount(l.ngram[-1], None, l.count-self.offset)
+                      for (l, _) in zip(lines, listed)
+                      if l.ngram[-1] not in excluded and l.count > self.offset)
+
+        top_tokens = []
+        while len(top_tokens) < k:
+            batch = tuple(itertools.islice(candidates, k - len(top_tokens)))
+            if len(batch) == 0:
+                # The next value of the count is the number of listed lines
+                if next(listed) < stats.successors:
+                    return self._top_k_level(context, backed_off, k)
+                break
+
+            covered = self._covered_tokens((t.token for t in batch), context,
+                                           backed_off)
+            top_tokens += (t for t in batch if t.token not in covered)
+
+        return (tuple(top_tokens), full_count, backoff_count)
+
+    def _iter_count_ordered_tokens(self, context, backed_off):
+        """
+        Count order version of _iter_matching_tokens. The successors of the
+        context are read from the complete top-k table, in the order of
+        descending counts. The back-off pseudo-token comes last, as in the token
+        order.
+        """
+
+        (stats, excluded, full_count, backoff_count) = self._indexed_level(
+            context, backed_off)
+
+        b = 0
+
+        if stats is not None:
+            n = len(context) + 1
+
+            # Tokens which are covered by the higher order model
+            covered = set()
+            if backed_off is not None:
+                ograms_range = self._bs_range(n+1, (backed_off,) + context)
+                if ograms_range is not None:
+                    (ifirst, ilast) = ograms_range
+                    covered = set(l.ngram[-1] for l in iter_bindb_file(
+                        self.f[n+1], n+1, ifirst, ilast-ifirst+1))
+
+            for l in iter_bindb_file(self.topk_f[n], n, stats.first,
+                                     stats.successors):
+                token = l.ngram[-1]
+                if token not in excluded and token not in covered:
+                    yield TokenCount(token, b, l.count - self.offset)
+                    b += l.count - self.offset
+
+        if backoff_count is not None:
+            yield TokenCount(self.backoff, b, backoff_count)
+
+    def _scan_count_ordered_tokens(self, context, backed_off, stop):
+        """
+        Return the first token matching a context in the count order for which
+        the stop function is true or None if there is no such token. Frequent
+        tokens come first, so the scan usually ends after a few lines. The scan
+        is recorded in the query trace if it is enabled.
+        """
+
+        start = time.perf_counter()
+
+        token = next((t for t in self._iter_count_ordered_tokens(context,
+                                                                 backed_off)
+                      if stop(t)), None)
+
+        if self.trace is not None:
+            self.trace.level(context, time.perf_counter() - start)
+
+        return token
+
+    def _scans_count_ordered(self, context, backed_off):
+        """
+        Return whether single tokens matching a context are found by scanning
+        the count order up to them, instead of reading all matching tokens.
+        """
+        return self.count_order and not self._start_only(context, backed_off)
+
+    def _start_only(self, context, backed_off):
+        """
+        Return whether a _START_ token is the only option, i.e. at the
+        beginning of a sentence or directly after an _END_ token.
+        """
+        return ((len(context) == 0 and backed_off is None) or
+                (len(context) > 0 and context[-1] == self.end))
+
+    def top_k(self, context, k):
+        """
+        Return the k most probable next tokens given the context, sorted by
+        descending probability, as TokenProbability tuples. The probabilities
+        are the lengths of the respective conditional probability intervals.
+
+        If the model was created with top-k tables, the query reads only the
+        most frequent successors of the contexts along the back-off path. A
+        back-off level whose top-k table lists fewer than k acceptable tokens
+        out of more successors is scanned in full.
+        """
+
+        # Only use context within the order of the model
+        context = take(context, -(self.n_max-1))
+        backed_off = None
+
+        if self.topk:
+            top_k_level = self._top_k_level_indexed
+        else:
+            top_k_level = self._top_k_level
+
+        # Probability mass left for the current level of the back-off path
+        mass = rational(1)
+        result = []
+
+        while True:
+            (tokens, full_count, backoff_count) = top_k_level(
+                context, backed_off, k)
+
+            result = heapq.nsmallest(k, result + [
+                TokenProbability(t.token, mass*rational(t.l, full_count))
+                for t in tokens
+            ], key=lambda t: (-t.p, t.token))
+
+            if backoff_count is None:
+                break
+
+            mass *= rational(backoff_count, full_count)
+
+            # Tokens on lower levels are not more probable than the mass left
+            if len(result) == k and mass < result[-1].p:
+                break
+
+            (context, backed_off) = (context[1:], context[0])
+
+        return tuple(result)
+
+    def _resolve_levels(self, pairs):
+        """
+        Find the matching and back-off tokens needed for many (token, context)
+        pairs at each (context, backed_off) level of the conditional probability
+        tree. Return a dictionary of (matches, back-off token, full count)
+        tuples keyed by the levels, where matches is a dictionary of the needed
+        tokens found at the level.
+
+        The lookups are grouped by levels, so each level is iterated over only
+        once. Levels of the same order are processed sorted by context, so each
+        table is searched from front to back.
+        """
+
+        # Tokens needed at each (context, backed_off) level
+        wanted = collections.defaultdict(set)
+        for (token, context) in pairs:
+            wanted[(context, None)].add(token)
+
+        levels = {}
+
+        # Back-off only goes to lower orders, so all levels of an order are
+        # known once the higher orders are processed
+        for n in range(self.n_max, 0, -1):
+            order_levels = sorted(
+                (l for l in wanted if len(l[0]) == n-1),
+                key=lambda l: (l[0], -1 if l[1] is None else l[1])
+            )
+
+            ranges = self._bs_ranges(n, (c for (c, b) in order_levels))
+            if n > 1:
+                ranges.update(self._bs_ranges(
+                    n-1, (c for (c, b) in order_levels
+                          if ranges[(n, c)] is not None)
+                ))
+            ranges.update(self._bs_ranges(
+                n+1, ((b,) + c for (c, b) in order_levels
+                      if b is not None and ranges[(n, c)] is not None)
+            ))
+
+            for (context, backed_off) in order_levels:
+                level = (context, backed_off)
+
+                matches = {}
+                backoff_token = None
+                full_count = None
+
+                for i in self._iter_matching_tokens(context, backed_off,
+                                                    ranges):
+                    if i.token in wanted[level]:
+                        matches[i.token] = i
+                    if i.token == self.backoff:
+                        backoff_token = i
+                    full_count = i.b + i.l
+
+                levels[level] = (matches, backoff_token, full_count)
+
+                # Tokens which were not found need to be backed-off, if
+                # possible
+                missing = wanted[level].difference(matches)
+                if len(missing) > 0 and backoff_token is not None:
+                    wanted[(context[1:], context[0])].update(missing)
+
+        return levels
+
+    def conditional_intervals(self, pairs):
+        """
+        Return the conditional probability intervals of many (token, context)
+        pairs, in the same order as the pairs. Each level of the conditional
+        probability tree is iterated over only once, see _resolve_levels.
+        """
+
+        # Only use context within the order of the model
+        pairs = tuple((token, take(context, -(self.n_max-1)))
+                      for (token, context) in pairs)
+
+        levels = self._resolve_levels(pairs)
+        intervals = {}
+
+        def interval(token, level):
+            """Return the interval of a token at a level of the tree."""
+
+            if (token, level) not in intervals:
+                (matches, backoff_token, full_count) = levels[level]
+
+                if token in matches:
+                    match = matches[token]
+                    intervals[(token, level)] = create_interval(
+                        match.b, match.l, full_count)
+                elif backoff_token is not None:
+                    backoff_interval = create_interval(
+                        backoff_token.b, backoff_token.l, full_count)
+                    backoff_subinterval = interval(
+                        token, (level[0][1:], level[0][0]))
+                    intervals[(token, level)] = select_subinterval(
+                        backoff_interval, backoff_subinterval)
+                else:
+                    raise Exception('Impossible sentence.')
+
+            return intervals[(token, level)]
+
+        return tuple(interval(token, (context, None))
+                     for (token, context) in pairs)
+
+    def log2_probabilities(self, pairs):
+        """
+        Return the base 2 logarithms of the conditional probabilities of many
+        (token, context) pairs, in the same order as the pairs. The computation
+        follows conditional_intervals, but uses floating point arithmetic
+        instead of exact intervals. Impossible tokens have a logarithm of minus
+        infinity.
+        """
+
+        # Only use context within the order of the model
+        pairs = tuple((token, take(context, -(self.n_max-1)))
+                      for (token, context) in pairs)
+
+        levels = self._resolve_levels(pairs)
+        logprobs = {}
+
+        def log2_probability(token, level):
+            """Return the log-probability of a token at a level of the tree."""
+
+            if (token, level) not in logprobs:
+                (matches, backoff_token, full_count) = levels[level]
+
+                if token in matches and matches[token].l > 0:
+                    logprobs[(token, level)] = (math.log2(matches[token].l) -
+                                                math.log2(full_count))
+                elif (token not in matches and backoff_token is not None and
+                      backoff_token.l > 0):
+                    logprobs[(token, level)] = (
+                        math.log2(backoff_token.l) - math.log2(full_count) +
+                        log2_probability(token, (level[0][1:], level[0][0]))
+                    )
+                else:
+                    logprobs[(token, level)] = float("-inf")
+
+            return logprobs[(token, level)]
+
+        return tuple(log2_probability(token, (context, None))
+                     for (token, context) in pairs)
+
+    @functools.lru_cache(maxsize=8192)
+    def _raw_conditional_interval(self, token, context, backed_off):
+        """Internal version of the conditional probability interval method."""
+
+        if self.interval_cache is not None:
+            interval = self.interval_cache.get(token, context, backed_off)
+            if interval is not None:
+                return interval
+
+        (match, backoff_token, full_count) = self._conditional_level(
+            token, context, backed_off)
+
+        if match is not None:
+            # If the token was found in the ngrams, report its interval
+            interval = create_interval(match.b, match.l, full_count)
+        elif backoff_token is not None:
+            # Otherwise, back-off the model and report the backed-off interval
+            # within the probability mass assigned to back-off
+            backoff_interval = create_interval(
+                backoff_token.b, backoff_token.l, full_count)
+            backoff_subinterval = self._raw_conditional_interval(
+                token, context[1:], context[0]
+            )
+            interval = select_subinterval(backoff_interval, backoff_subinterval)
+        else:
+            raise Exception('Impossible sentence.')
+
+        if self.interval_cache is not None:
+            self.interval_cache.put(token, context, backed_off, interval)
+
+        return interval
+
+    def _conditional_level(self, token, context, backed_off):
+        """
+        Find a token at a single level of the conditional probability tree.
+        Return the token (None if it does not match), the back-off pseudo-token
+        (None if back-off is not possible) and the full count of the level.
+        """
+
+        if self._scans_count_ordered(context, backed_off):
+            return self._find_count_ordered(token, context, backed_off)
+
+        match = None
+        backoff_token = None
+        full_count = 0
+
+        for i in self._matching_tokens(context, backed_off):
+            if i.token == token:
+                match = i
+            if i.token == self.backoff:
+                backoff_token = i
+            full_count = i.b + i.l
+
+        return (match, backoff_token, full_count)
+
+    @functools.lru_cache(maxsize=8192)
+    def _raw_conditional_counts(self, token, context, backed_off):
+        """Internal version of the conditional counts method."""
+
+        (match, backoff_token, full_count) = self._conditional_level(
+            token, context, backed_off)
+
+        if match is not None:
+            return (CountInterval(match.b, match.l, full_count),)
+        elif backoff_token is not None:
+            return ((CountInterval(backoff_token.b, backoff_token.l,
+                                   full_count),) +
+                    self._raw_conditional_counts(token, context[1:],
+                                                 context[0]))
+        else:
+            raise Exception('Impossible sentence.')
+
+    def _raw_next(self, search_interval, context, backed_off):
+        """Internal version of the next token method."""
+
+        # Numerators and denominators of the search interval base and end
+        (bp, bq) = (search_interval.b.numerator, search_interval.b.denominator)
+        (lp, lq) = (search_interval.l.numerator, search_interval.l.denominator)
+        (ep, eq) = (bp*lq + lp*bq, bq*lq)
+
+        # The search interval base and end scaled by the full count
+        full_count = self._full_count(context, backed_off)
+        (bf, ef) = (bp*full_count, ep*full_count)
+
+        token = None
+
+        if (self.next_search == "float" and
+            not self._scans_count_ordered(context, backed_off)):
+            token = self._guess_next(context, backed_off, bf, bq, ef, eq)
+
+        if token is None:
+            # The smallest window of integer counts containing the scaled search
+            # interval. Only the window matters for finding the token, so unlike
+            # the search interval it can be used as a cache key.
+            token = self._next_in_window(context, backed_off, bf // bq,
+                                         -(-ef // eq))
+
+        if token is None:
+            # No token can be found
+            return None
+        else:
+            # We have found a token -- standard or back-off
+            token_interval = create_interval(token.b, token.l, full_count)
+            scaled_search_interval = find_ratio(search_interval, token_interval)
+
+            if token.token == self.backoff:
+                return self._raw_next(scaled_search_interval, context[1:],
+                                      context[0])
+
+            else:
+                return NextSymbolSearchResult(token.token,
                                               scaled_search_interval)
 
+    def _find_count_ordered(self, token, context, backed_off):
+        """
+        Find a token matching a context in the count order. Return the token
+        (None if it does not match), the back-off pseudo-token (None if back-off
+        is not possible) and the full count of the level. The successors of the
+        context are not scanned at all if the token cannot be among them.
+        """
+
+        (stats, excluded, full_count, backoff_count) = self._indexed_level(
+            context, backed_off)
+
+        if backoff_count is None:
+            backoff_token = None
+        else:
+            backoff_token = TokenCount(self.backoff, full_count-backoff_count,
+                                       backoff_count)
+
+        if (stats is None or token in excluded or
+            self.count(context + (token,)) is None or
+            self._covered(token, context, backed_off)):
+            match = None
+        else:
+            match = self._scan_count_ordered_tokens(
+                context, backed_off, lambda t: t.token == token)
+
+        return (match, backoff_token, full_count)
+
+    @functools.lru_cache(maxsize=8)
+    def _recent_matching_tokens(self, context, backed_off):
+        """
+        Return a tuple of tokens matching a context. The most recent levels are
+        cached, so that the full count and the next token at a level are found
+        with a single lookup.
+        """
+        return self._matching_tokens(context, backed_off)
+
+    @functools.lru_cache(maxsize=8)
+    def _recent_token_bases(self, context, backed_off):
+        """Return the bases of the tokens matching a recent context."""
+        return tuple(t.b for t in self._recent_matching_tokens(context,
+                                                               backed_off))
+
+    def _guess_next(self, context, backed_off, bf, bq, ef, eq):
+        """
+        Guess the token found by _next_in_window using a floating point
+        approximation of the scaled search interval [bf/bq, ef/eq) and verify
+        the guess with a single exact comparison on integers. Return None if the
+        guess is wrong, which can only happen close to the boundaries between
+        tokens or if there is no matching token at all.
+        """
+
+        # Approximate position of the scaled search interval base among the
+        # cumulative counts. Division of integers is correctly rounded
+        # regardless of their size, so this is accurate to float precision.
+        i = bisect.bisect_right(self._recent_token_bases(context, backed_off),
+                                bf / bq) - 1
+
+        if i < 0:
+            return None
+
+        # Since token counts are integers, the token counts are a superinterval
+        # of the window of counts if and only if they are a superinterval of the
+        # exact scaled search interval
+        token = self._recent_matching_tokens(context, backed_off)[i]
+
+        if token.b*bq <= bf and ef <= (token.b+token.l)*eq:
+            return token
+        else:
+            return None
+
+    @functools.lru_cache(maxsize=8192)
+    def _full_count(self, context, backed_off):
+        """Return the full count of the tokens matching a context."""
+
+        if self._scans_count_ordered(context, backed_off):
+            return self._indexed_level(context, backed_off)[2]
+
+        tokens = self._recent_matching_tokens(context, backed_off)
+        return tokens[-1].b + tokens[-1].l
+
+    @functools.lru_cache(maxsize=8192)
+    def _next_in_window(self, context, backed_off, base, end):
+        """
+        Return the token matching a context whose counts contain the window of
+        counts [base, end) or None if there is no such token.
+        """
+
+        if self._scans_count_ordered(context, backed_off):
+            (stats, excluded, full_count, backoff_count) = self._indexed_level(
+                context, backed_off)
+
+            # The back-off pseudo-token comes last, so the scan can be skipped
+            # if the window starts within its counts
+            if backoff_count is not None and full_count-backoff_count <= base:
+                token = TokenCount(self.backoff, full_count-backoff_count,
+                                   backoff_count)
+            else:
+                token = self._scan_count_ordered_tokens(
+                    context, backed_off, lambda t: t.b + t.l > base)
+
+            if token is not None and token.b + token.l >= end:
+                return token
+            else:
+                return None
+
+        tokens = self._recent_matching_tokens(context, backed_off)
+        i = exact_interval_bs(tokens, base, end)
+
+        return None if i is None else tokens[i]
+
+# Cached intervals of all models are of the backend they were created with
+on_backend_change(BinDBLM._raw_conditional_interval.cache_clear)
+
+def exact_interval_bs(tokens, base, end):
+    """
+    Find using binary search the position of a token whose counts are a
+    superinterval of the window of counts [base, end). Return None if there is
+    no such token.
+    """
+
+    imin = 0
+    imax = len(tokens)-1
+
+    while imin <= imax:
+        imid = round((imin+imax)/2)
+
+        if tokens[imid].b <= base and tokens[imid].b + tokens[imid].l >= end:
+            return imid
+        elif tokens[imid].b + tokens[imid].l <= base:
+            imin = imid + 1
+        else:
+            imax = imid - 1
+
+class BinDBPrefetcher:
+    """
+    Speculative prefetcher of the distributions used by the next token search
+    of a BinDB language model. When the next token is searched for, background
+    threads find the tokens matching the contexts which would follow the most
+    probable next tokens, so that they are ready for the subsequent search.
+
+    Counters describe how useful prefetching is:
+
+    requested  - number of next token searches
+    hits       - searches whose distribution was already prefetched or cached
+    prefetched - number of distributions submitted for prefetching
+    useful     - prefetched distributions which were later requested
+    wasted     - prefetched distributions discarded without being requested
+    """
+
+    def __init__(self, lm, contexts, threads, cache_size=64):
+        self.lm = lm
+        self.contexts = contexts    # Number of speculative contexts
+        self.cache_size = cache_size
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+
+        # Futures of the distributions keyed by context, in the order of use,
+        # and contexts which were prefetched but not yet requested
+        self.futures = collections.OrderedDict()
+        self.unused = set()
+        self.lock = threading.Lock()
+
+        self.requested = 0
+        self.hits = 0
+        self.prefetched = 0
+        self.useful = 0
+        self.wasted = 0
+
+    def _matching_tokens(self, context):
+        """Find the tokens matching a context in a background thread."""
+        return tuple(self.lm._iter_matching_tokens(context, None))
+
+    def _add(self, context, future):
+        """Add a future to the cache, discarding the least recently used."""
+
+        self.futures[context] = future
+
+        while len(self.futures) > self.cache_size:
+            (old_context, old_future) = self.futures.popitem(last=False)
+            old_future.cancel()
+
+            if old_context in self.unused:
+                self.unused.remove(old_context)
+                self.wasted += 1
+
+    def get(self, context, record=False):
+        """
+        Return the tokens matching a context, waiting for them to be prefetched
+        if necessary. Optionally record the request in the counters.
+        """
+
+        with self.lock:
+            if record:
+                self.requested += 1
+
+            if context in self.futures:
+                if record:
+                    self.hits += 1
+
+                self.futures.move_to_end(context)
+                future = self.futures[context]
+
+                if context in self.unused:
+                    self.unused.remove(context)
+                    self.useful += 1
+            else:
+                future = None
+
+        if future is not None and not future.cancelled():
+            return future.result()
+
+        tokens = self._matching_tokens(context)
+
+        future = concurrent.futures.Future()
+        future.set_result(tokens)
+
+        with self.lock:
+            self._add(context, future)
+
+        return tokens
+
+    def prefetch(self, context):
+        """
+        Start prefetching the distributions of contexts following the most
+        probable next tokens given the current context.
+        """
+
+        tokens = self.get(context, record=True)
+
+        candidates = heapq.nsmallest(
+            self.contexts,
+            (t for t in tokens if t.token != self.lm.backoff),
+            key=lambda t: (-t.l, t.token)
+        )
+
+        with self.lock:
+            for t in candidates:
+                next_context = take(context + (t.token,), -(self.lm.n_max-1))
+
+                if next_context not in self.futures:
+                    self._add(next_context, self.executor.submit(
+                        self._matching_tokens, next_context))
+                    self.unused.add(next_context)
+                    self.prefetched += 1
+
+    def shutdown(self):
+        """Stop the background threads."""
+        self.executor.shutdown(wait=False)
+
+class BinDBTraceRecorder:
+    """
+    Recorder of the conditional_interval and next calls of a BinDB language
+    model, saved to a query trace file. Besides the token, the context and the
+    duration of each call, it records the levels of the conditional
+    probability tree which were looked up following the back-off path, each
+    with the duration of the lookup. Levels served by the in-memory caches of
+    the model are not looked up, so they do not appear in the trace.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.f.write(_TRACE_MAGIC)
+
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+        # Language models are often kept alive until the interpreter exits, so
+        # make sure that the buffered records are not lost
+        atexit.register(self.close)
+
+    def begin(self):
+        """Start recording a call in the current thread."""
+        self._local.levels = []
+        self._local.start = time.perf_counter()
+
+    def level(self, context, duration):
+        """Record a lookup of a level if a call is being recorded."""
+
+        levels = getattr(self._local, "levels", None)
+
+        if levels is not None:
+            levels.append((len(context), duration))
+
+    def end(self, kind, token, context):
+        """Finish recording a call and save its record."""
+
+        duration = time.perf_counter() - self._local.start
+        levels = self._local.levels
+        self._local.levels = None
+
+        record = b"".join(itertools.chain(
+            (_TRACE_HEADER.pack(kind, len(context), len(levels), token,
+                                duration),
+             struct.pack("<{}i".format(len(context)), *context)),
+            (_TRACE_LEVEL.pack(*l) for l in levels)
+        ))
+
+        with self.lock:
+            if self.f is not None:
+                self.f.write(record)
+
+    def close(self):
+        """Close the trace file."""
+
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+# Format of the query trace file -- a magic string followed by records. Each
+# record is a header with the kind of the call, the length of the context, the
+# number of levels, the token (0 if none) and the duration of the call, followed
+# by the context and the levels, each as the length of its context and the
+# duration of its lookup.
+_TRACE_MAGIC = b"BINDBTR1"
+_TRACE_HEADER = struct.Struct("<BBHid")
+_TRACE_LEVEL = struct.Struct("<Bd")
+
+def iter_trace_file(path):
+    """Iterate over the records of a query trace file."""
+
+    with open(path, "rb") as f:
+        if f.read(len(_TRACE_MAGIC)) != _TRACE_MAGIC:
+            raise ValueError("{} is not a query trace file.".format(path))
+
+        while True:
+            header = f.read(_TRACE_HEADER.size)
+
+            if len(header) == 0:
+                return
+
+            (kind, m, number, token, duration) = _TRACE_HEADER.unpack(header)
+            context = struct.unpack("<{}i".format(m), f.read(4*m))
+
+            # Levels are identified by the length of their context, which
+            # determines how far along the back-off path they are
+            levels = []
+            for (level_m, level_duration) in _TRACE_LEVEL.iter_unpack(
+                f.read(number * _TRACE_LEVEL.size)
+            ):
+                depth = m - level_m
+                levels.append(TraceLevel(
+                    context[depth:], context[depth-1] if depth > 0 else None,
+                    level_duration
+                ))
+
+            if kind == TRACE_NEXT and token == 0:
+                token = None
+
+            yield TraceRecord(kind, token, context, tuple(levels), duration)
+
+# Format of the warm cache file header -- a magic string, the parameters and the
+# fingerprint of the language model, the number of cached levels and the offset
+# of the tokens
+_WARM_CACHE_MAGIC = b"BINDBWC3"
+_WARM_CACHE_HEADER = struct.Struct("<8siiiddq?32sqq")
+
+# A single token of a cached distribution -- token index and adjusted count
+_WARM_CACHE_TOKEN = struct.Struct("<iq")
+
+def _warm_cache_key(n_max, context, backed_off):
+    """
+    Format specifier and key of a cached (context, backed_off) level. Contexts
+    are padded to the length (n_max-1) and a missing back-off token is saved as
+    0, which is not a valid token index.
+    """
+    return (
+        struct.Struct("<ii" + (n_max-1) * "i" + "qq"),
+        ((0 if backed_off is None else backed_off, len(context)) + context +
+         (0,) * (n_max-1-len(context)))
+    )
+
+def write_warm_cache(path, lm, levels):
+    """
+    Save distributions of the language model at the given (context, backed_off)
+    levels to a warm cache file.
+
+    The file consists of a header, a sorted array of keys of the levels together
+    with the location of their tokens and an array of tokens with their
+    adjusted counts. Bases of the tokens are not saved, since they are
+    cumulative sums of the counts.
+    """
+
+    levels = sorted(set(levels), key=lambda l:
+                    _warm_cache_key(lm.n_max, l[0], l[1])[1])
+
+    (key_struct, _) = _warm_cache_key(lm.n_max, (), None)
+    tokens_offset = _WARM_CACHE_HEADER.size + len(levels) * key_struct.size
+
+    with open(path, "wb") as f:
+        f.write(_WARM_CACHE_HEADER.pack(
+            _WARM_CACHE_MAGIC, *lm.parameters() + (
+                bytes.fromhex(lm.fingerprint()), len(levels), tokens_offset)
+        ))
+
+        distributions = []
+        i = 0
+
+        for (context, backed_off) in levels:
+            tokens = tuple(lm.iter_matching_tokens(context, backed_off))
+            distributions.append(tokens)
+
+            key = _warm_cache_key(lm.n_max, context, backed_off)[1]
+            f.write(key_struct.pack(*key + (i, len(tokens))))
+            i += len(tokens)
+
+        for tokens in distributions:
+            for t in tokens:
+                f.write(_WARM_CACHE_TOKEN.pack(t.token, t.l))
+
+class BinDBWarmCache:
+    """
+    Read-only cache of distributions of a BinDB language model, i.e. tokens
+    matching contexts at particular levels of the conditional probability tree,
+    loaded from a memory-mapped file created by write_warm_cache.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = _WARM_CACHE_HEADER.unpack_from(self.mmap)
+
+        if header[0] != _WARM_CACHE_MAGIC:
+            raise ValueError("{} is not a warm cache file.".format(path))
+
+        self.parameters = ModelParameters(*header[1:8])
+        self.fingerprint = header[8].hex()
+        (self.size, self.tokens_offset) = header[9:]
+
+        (self.key_struct, _) = _warm_cache_key(self.parameters.n_max, (), None)
+
+    def __del__(self):
+        # The initialisation might have failed before mapping the file
+        if getattr(self, "mmap", None) is not None:
+            self.mmap.close()
+
+    def _read_key(self, i):
+        """Return the i'th (0-indexed) key with the location of its tokens."""
+        return self.key_struct.unpack_from(
+            self.mmap, _WARM_CACHE_HEADER.size + i * self.key_struct.size)
+
+    def get(self, context, backed_off):
+        """
+        Return the tuple of tokens matching a context at a level of the
+        conditional probability tree or None if the level is not cached.
+        """
+
+        key = _warm_cache_key(self.parameters.n_max, context, backed_off)[1]
+
+        # Binary search for the key
+        imin = 0
+        imax = self.size
+
+        while imin < imax:
+            imid = (imin+imax) // 2
+            if self._read_key(imid)[:-2] < key:
+                imin = imid + 1
+            else:
+                imax = imid
+
+        if imin == self.size or self._read_key(imin)[:-2] != key:
+            return None
+
+        (first, number) = self._read_key(imin)[-2:]
+
+        tokens = []
+        b = 0
+
+        for (token, l) in _WARM_CACHE_TOKEN.iter_unpack(self.mmap[
+            self.tokens_offset + first * _WARM_CACHE_TOKEN.size:
+            self.tokens_offset + (first+number) * _WARM_CACHE_TOKEN.size
+        ]):
+            tokens.append(TokenCount(token, b, l))
+            b += l
+
+        return tuple(tokens)
+
+class BinDBIntervalCache:
+    """
+    Persistent cache of conditional probability intervals of a BinDB language
+    model, stored in an SQLite database. Entries are namespaced by the
+    fingerprint of the model, so that intervals of a different model are never
+    returned. The least recently used entries are evicted when the cache has
+    more entries than its maximum size.
+
+    New entries and uses of existing ones are buffered and written in a single
+    transaction, so that the database is not locked between the writes.
+
+    The cache can be used from several threads, which share the connection to
+    the database and the buffers under a lock.
+    """
+
+    # Number of buffered writes after which they are flushed to the database
+    flush_interval = 1000
+
+    def __init__(self, path, fingerprint, max_size):
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+
+        # Reentrant, since a full buffer is flushed while holding the lock
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS intervals (
+                    fingerprint TEXT NOT NULL,
+                    token INTEGER NOT NULL,
+                    context TEXT NOT NULL,
+                    backed_off INTEGER NOT NULL,
+                    b TEXT NOT NULL,
+                    l TEXT NOT NULL,
+                    used INTEGER NOT NULL,
+                    PRIMARY KEY (fingerprint, token, context, backed_off)
+                )
+            """)
+            self.db.execute("""
+                CREATE INDEX IF NOT EXISTS intervals_used ON intervals (used)
+            """)
+
+        # Logical clock of the last use of each entry
+        self.clock = self.db.execute(
+            "SELECT IFNULL(MAX(used), 0) FROM intervals").fetchone()[0]
+
+        # Buffered new intervals and uses of the existing ones
+        self.new = {}
+        self.used = {}
+
+        # Language models are often kept alive until the interpreter exits, so
+        # make sure that the buffers are not lost
+        atexit.register(self.flush)
+
+    def _key(self, token, context, backed_off):
+        """Key of an interval in the database."""
+        return (self.fingerprint, token, " ".join(map(str, context)),
+                0 if backed_off is None else backed_off)
+
+    def _tick(self):
+        """Advance the logical clock and flush the buffers if they are full."""
+
+        self.clock += 1
+
+        if len(self.new) + len(self.used) >= self.flush_interval:
+            self.flush()
+
+        return self.clock
+
+    def get(self, token, context, backed_off):
+        """Return a cached interval or None if it is not in the cache."""
+
+        key = self._key(token, context, backed_off)
+
+        with self.lock:
+            if key in self.new:
+                return Interval(rational(self.new[key][0]),
+                                rational(self.new[key][1]))
+
+            row = self.db.execute(
+                "SELECT b, l FROM intervals WHERE fingerprint = ? AND "
+                "token = ? AND context = ? AND backed_off = ?", key
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.used[key] = self._tick()
+
+        return Interval(rational(row[0]), rational(row[1]))
+
+    def put(self, token, context, backed_off, interval):
+        """Save an interval in the cache."""
+        key = self._key(token, context, backed_off)
+
+        with self.lock:
+            self.new[key] = (str(interval.b), str(interval.l), self._tick())
+
+    def flush(self):
+        """Write the buffers and evict the least recently used entries."""
+
+        with self.lock:
+            if self.db is None:
+                return
+
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO intervals VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?)",
+                    (key + value for (key, value) in self.new.items())
+                )
+                self.db.executemany(
+                    "UPDATE intervals SET used = ? WHERE fingerprint = ? AND "
+                    "token = ? AND context = ? AND backed_off = ?",
+                    ((used,) + key for (key, used) in self.used.items())
+                )
+                self.db.execute(
+                    "DELETE FROM intervals WHERE used <= (SELECT used FROM "
+                    "intervals ORDER BY used DESC LIMIT 1 OFFSET ?)",
+                    (self.max_size,)
+                )
+
+            self.new = {}
+            self.used = {}
+
+    def close(self):
+        """Flush the buffers and close the database."""
+
+        with self.lock:
+            if self.db is not None:
+                self.flush()
+                self.db.close()
+                self.db = None
+
+def read_coding_order(bindb_dir):
+    """
+    Return the coding order of the successors of contexts which a directory of
+    BinDB tables supports -- "count" if complete top-k tables were created for
+    it and "token" otherwise. Every directory supports the token order.
+    """
+
+    path = os.path.join(bindb_dir, CODING_ORDER_FILE)
+
+    if not os.path.exists(path):
+        return "token"
+
+    with open(path, "r") as f:
+        order = f.read().strip()
+
+    assert(order in ("token", "count"))
+    return order
+
+def write_coding_order(bindb_dir, order):
+    """Mark the coding order supported by a directory of BinDB tables."""
+
+    assert(order in ("token", "count"))
+
+    with open(os.path.join(bindb_dir, CODING_ORDER_FILE), "w") as f:
+        f.write(order + "\n")
+
 @functools.lru_cache(maxsize=8)
 def fmt(n):
     """Format specifier for a BinDBLine of order n."""
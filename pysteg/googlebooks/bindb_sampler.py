@@ -0,0 +1,215 @@
+import collections
+import random
+
+from pysteg.common.listtools import take
+from pysteg.googlebooks.bindb import iter_bindb_file
+
+# Walker alias table of a discrete distribution over tokens. The probabilities
+# are represented exactly with integers -- column i is chosen with probability
+# 1/len(tokens) and then token i is drawn if a random integer below total is
+# lower than prob[i], otherwise token alias[i] is drawn.
+AliasTable = collections.namedtuple("AliasTable", "tokens prob alias total")
+
+def create_alias_table(tokens, weights):
+    """
+    Create an alias table of tokens drawn proportionally to non-negative integer
+    weights using Vose's algorithm.
+    """
+
+    n = len(tokens)
+    total = sum(weights)
+
+    assert(n > 0 and total > 0)
+
+    # Weights scaled so that the average column is filled up to total
+    scaled = [w * n for w in weights]
+
+    small = [i for i in range(n) if scaled[i] < total]
+    large = [i for i in range(n) if scaled[i] >= total]
+
+    prob = [total] * n
+    alias = list(range(n))
+
+    # Fill up each underfull column with the excess of an overfull one
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+
+        prob[s] = scaled[s]
+        alias[s] = g
+
+        scaled[g] -= total - scaled[s]
+        if scaled[g] < total:
+            small.append(g)
+        else:
+            large.append(g)
+
+    return AliasTable(tuple(tokens), tuple(prob), tuple(alias), total)
+
+def _table_size(table):
+    """Return the number of tokens of an alias table, which may be None."""
+    return 1 if table is None else len(table.tokens)
+
+def draw(table, rng):
+    """Draw a token from an alias table using a random number generator."""
+
+    i = rng.randrange(len(table.tokens))
+
+    if rng.randrange(table.total) < table.prob[i]:
+        return table.tokens[i]
+    else:
+        return table.tokens[table.alias[i]]
+
+class BinDBSampler:
+    """
+    Fast sampler of sentences from a BinDB language model. Tokens are drawn from
+    the same conditional distributions as used in arithmetic coding, but using
+    alias tables instead of exact interval arithmetic. Alias tables are cached
+    for the most recently used contexts, up to a total number of tokens in the
+    cached tables.
+
+    Backed-off unigram levels share a single alias table of all unigrams, since
+    a table of each of them would have an entry for almost every token of the
+    vocabulary. Tokens drawn from it are rejected and drawn again if they are
+    not accepted at the level, e.g. if they are covered by the bigram model.
+    Only a level rejecting a given number of tokens in a row gets its own
+    table.
+    """
+
+    def __init__(self, lm, cache_size=1000000, max_rejections=100, seed=None):
+        self.lm = lm
+        self.rng = random.Random(seed)
+
+        self.cache_size = cache_size
+        self._tables = collections.OrderedDict()
+        self._cached_tokens = 0
+
+        self.max_rejections = max_rejections
+        self._unigram_table = None
+
+    def _alias_table(self, context, backed_off):
+        """
+        Return the alias table of a context at a single level of the
+        conditional probability tree, evicting the least recently used tables
+        once the cache holds too many tokens.
+        """
+
+        key = (context, backed_off)
+
+        if key in self._tables:
+            self._tables.move_to_end(key)
+            return self._tables[key]
+
+        table = self._create_alias_table(context, backed_off)
+
+        self._tables[key] = table
+        self._cached_tokens += _table_size(table)
+
+        while self._cached_tokens > self.cache_size and len(self._tables) > 1:
+            (_, evicted) = self._tables.popitem(last=False)
+            self._cached_tokens -= _table_size(evicted)
+
+        return table
+
+    def _create_alias_table(self, context, backed_off):
+        """
+        Create an alias table of tokens matching a context of length (n-1) at a
+        single level of the conditional probability tree. Return None if there
+        are no such tokens.
+        """
+
+        tokens = tuple(t for t in self.lm.iter_matching_tokens(context,
+                                                               backed_off)
+                       if t.l > 0)
+
+        if len(tokens) == 0:
+            return None
+
+        return create_alias_table(tuple(t.token for t in tokens),
+                                  tuple(t.l for t in tokens))
+
+    def _accepted_unigram(self, token, backed_off):
+        """
+        Return whether a unigram is accepted at the level backed-off from a
+        bigram context, i.e. it is neither excluded nor covered by the bigram
+        model.
+        """
+
+        if token == self.lm.end and backed_off == self.lm.start:
+            return False
+
+        return self.lm.count((backed_off, token)) is None
+
+    def _draw_unigram(self, backed_off):
+        """
+        Draw a token at the unigram level backed-off from a bigram context by
+        rejection sampling from the shared alias table of all unigrams. Return
+        None if no token is accepted at this level.
+        """
+
+        if self._unigram_table is None:
+            # _START_ tokens are never accepted at unigram levels
+            lines = tuple(l for l in iter_bindb_file(self.lm.f[1], 1)
+                          if l.ngram[0] != self.lm.start and
+                          l.count > self.lm.offset)
+            self._unigram_table = create_alias_table(
+                tuple(l.ngram[0] for l in lines),
+                tuple(l.count - self.lm.offset for l in lines))
+
+        for i in range(self.max_rejections):
+            token = draw(self._unigram_table, self.rng)
+            if self._accepted_unigram(token, backed_off):
+                return token
+
+        # Most of the unigrams are not accepted, so draw from the exact table
+        table = self._alias_table((), backed_off)
+
+        return None if table is None else draw(table, self.rng)
+
+    def next(self, context):
+        """Draw the next token given the context."""
+
+        # Only use context within the order of the model
+        context = take(context, -(self.lm.n_max-1))
+
+        while True:
+            (level_context, backed_off) = (context, None)
+
+            while True:
+                if len(level_context) == 0 and backed_off is not None:
+                    # There is no back-off from unigram levels
+                    token = self._draw_unigram(backed_off)
+                    if token is None:
+                        break
+                    return token
+
+                table = self._alias_table(level_context, backed_off)
+
+                # Every token on this level is covered by the higher order
+                # model, so the back-off path is a dead end -- draw again
+                if table is None:
+                    break
+
+                token = draw(table, self.rng)
+
+                if token != self.lm.backoff:
+                    return token
+
+                (level_context, backed_off) = (level_context[1:],
+                                               level_context[0])
+
+    def sentence(self):
+        """Draw a sentence, starting with a _START_ and ending with an _END_."""
+
+        sequence = []
+
+        while len(sequence) == 0 or sequence[-1] != self.lm.end:
+            sequence.append(self.next(tuple(sequence)))
+
+        return tuple(sequence)
+
+    def sentences(self, number):
+        """Generate a number of independently drawn sentences."""
+
+        for i in range(number):
+            yield self.sentence()
@@ -1,10 +1,15 @@
+import collections
+import itertools
+import multiprocessing
 import pprint
 
 import sympy
 
 from pysteg.coding.interval import bits2interval, interval2bits
+from pysteg.coding.rational_ac import IncrementalEncoder
 from pysteg.coding.rational_ac import decode, deep_decode, encode
-from pysteg.crypto import random_bits, decrypt, encrypt
+from pysteg.common.bits import Bits
+from pysteg.crypto import make_rng, random_bits, decrypt, encrypt
 from pysteg.googlebooks.ngrams_analysis import normalise_and_explode_tokens
 from pysteg.googlebooks.ngrams_analysis import text2token_strings
 from pysteg.googlebooks.ngrams_analysis import token_strings2text
@@ -15,8 +20,11 @@ class Sentence:
     """
 
     def __init__(self, index, lm, input, input_type, binary_interval,
-                 decode_mode=None):
-        """Initialise the sentence either from text or from an interval."""
+                 decode_mode=None, rng=None):
+        """
+        Initialise the sentence either from text or from an interval. Deep
+        decoding optionally draws random bits from a given source.
+        """
 
         assert(input_type in ("text", "interval"))
         assert(binary_interval in (None, "sub", "super"))
@@ -37,7 +45,8 @@ class Sentence:
             start_interval = input
             if decode_mode == "deep":
                 decoding_result = deep_decode(lm.next, start_interval,
-                                              end=self.index.s2i("_END_"))
+                                              end=self.index.s2i("_END_"),
+                                              rng=rng)
             elif decode_mode == "shallow":
                 decoding_result = decode(lm.next, start_interval)
             self.token_indices = decoding_result.sequence
@@ -46,37 +55,45 @@ class Sentence:
             if binary_interval:
                 self.bits = interval2bits(self.interval, binary_interval)
 
-    def __str__(self):
-        entropy = float(sympy.N(-sympy.log(self.interval.l, 2)))
+    def _description(self):
+        """Return a dictionary describing the sentence."""
 
         description = {}
         description["Type"] = type(self).__name__
         description["Token indices"] = " ".join(map(str, self.token_indices))
         description["Token strings"] = " ".join(self.token_strings)
-        description["Interval"] = str(self.interval)
-        description["Entropy"] = "{:.1f} bits".format(entropy)
+        if self.interval is not None:
+            entropy = float(sympy.N(-sympy.log(self.interval.l, 2)))
+            description["Interval"] = str(self.interval)
+            description["Entropy"] = "{:.1f} bits".format(entropy)
         description["Binary representation"] = " ".join(map(str, self.bits))
         description["Binary representation entropy"] = "{} bits".format(
             len(self.bits))
         description["Text representation"] = token_strings2text(self.token_strings)
 
-        return(pprint.pformat(description))
+        return description
+
+    def __str__(self):
+        return(pprint.pformat(self._description()))
 
 class Key(Sentence):
 
-    def __init__(self, index, lm, mode, input):
+    def __init__(self, index, lm, mode, input, rng=None):
         """
         Generate key with a given minimum number of bits or create it from
-        supplied text.
+        supplied text. Generated keys are optionally drawn from a given source
+        of random bits.
         """
 
         assert(mode in ("generate", "save"))
 
         if mode == "generate":
             min_number_of_bits = input
-            start_interval = bits2interval(random_bits(min_number_of_bits))
+            start_interval = bits2interval(random_bits(min_number_of_bits,
+                                                       rng=rng))
             super().__init__(index, lm, start_interval, input_type="interval",
-                             binary_interval="super", decode_mode="deep")
+                             binary_interval="super", decode_mode="deep",
+                             rng=rng)
         elif mode == "save":
             super().__init__(index, lm, input, input_type="text",
                              binary_interval="super")
@@ -92,7 +109,7 @@ class Plaintext(Sentence):
         assert(mode in ("decode_bits", "save"))
 
         if mode == "decode_bits":
-            self.bits = input
+            self.bits = Bits(input)
             interval = bits2interval(self.bits)
             super().__init__(index, lm, interval, input_type="interval",
                              binary_interval=None, decode_mode="shallow")
@@ -102,10 +119,10 @@ class Plaintext(Sentence):
 
 class Stegotext(Sentence):
 
-    def __init__(self, index, lm, mode, input):
+    def __init__(self, index, lm, mode, input, rng=None):
         """
         Initialise stegotext either from bits encrypted from plaintext or
-        directly from text.
+        directly from text, optionally using a given source of random bits.
         """
 
         assert(mode in ("decode_bits", "save"))
@@ -114,29 +131,307 @@ class Stegotext(Sentence):
             bits = input
             interval = bits2interval(bits)
             super().__init__(index, lm, interval, input_type="interval",
-                             binary_interval="super", decode_mode="deep")
+                             binary_interval="super", decode_mode="deep",
+                             rng=rng)
         elif mode == "save":
             super().__init__(index, lm, input, input_type="text",
                              binary_interval="super")
 
+# Framing of messages coded as independent blocks of sentences, which both
+# sides of the stegosystem have to agree on:
+#
+# sentences   - number of plaintext sentences in a block (except the last one)
+# chunk_bits  - number of ciphertext bits carried by a block of stegotext
+# length_bits - width of the integer fields of framed plaintext bits
+#
+# The framing is not transmitted, it is a shared parameter like the key. A
+# stegosystem only codes text with its own framing and raises TypeError
+# otherwise, but a receiver using another framing than the sender cannot detect
+# it -- the bits are just unframed or split into blocks differently.
+BlockFraming = collections.namedtuple("BlockFraming",
+    "sentences chunk_bits length_bits")
+
+def split_sentences(token_indices, end):
+    """Split token indices into sentences ending with the end token."""
+
+    sentences = [[]]
+
+    for token in token_indices:
+        sentences[-1].append(token)
+        if token == end:
+            sentences.append([])
+
+    return tuple(tuple(sentence) for sentence in sentences if sentence)
+
+def frame_blocks(blocks_bits, last_sentences, framing):
+    """
+    Join bits of plaintext blocks into a single sequence of bits. It starts with
+    the number of blocks and the number of sentences in the last block, and
+    then every block is preceded by its length. Raise ValueError if any of
+    these numbers does not fit in the width of the fields.
+    """
+
+    w = framing.length_bits
+
+    def field(value, name):
+        if not 0 <= value < 1 << w:
+            raise ValueError("The {} {} does not fit in {} bits of the "
+                             "framing.".format(name, value, w))
+        return Bits.from_int(value, w)
+
+    bits = (field(len(blocks_bits), "number of blocks") +
+            field(last_sentences, "number of sentences"))
+
+    for block_bits in blocks_bits:
+        bits += field(len(block_bits), "block length") + block_bits
+
+    return bits
+
+def unframe_blocks(bits, framing):
+    """
+    Split framed bits of plaintext blocks. Return bits of the blocks and the
+    number of sentences in the last block. Bits following the last block are
+    ignored.
+    """
+
+    w = framing.length_bits
+    bits = Bits(bits)
+
+    def field(position, width):
+        if position + width > len(bits):
+            raise ValueError("Framed bits are truncated.")
+        return bits[position:position+width]
+
+    number = field(0, w).value
+    last_sentences = field(w, w).value
+
+    blocks_bits = []
+    position = 2*w
+
+    for i in range(number):
+        length = field(position, w).value
+        blocks_bits.append(field(position+w, length))
+        position += w + length
+
+    return (tuple(blocks_bits), last_sentences)
+
+def _init_block_worker(lm):
+    """Set the language model used to code blocks in a worker process."""
+    global _block_lm
+    _block_lm = lm
+
+def _init_block_pool_worker(lm):
+    """
+    Set a copy of the language model used to code blocks in a worker process.
+    Initialiser arguments are not pickled when workers are forked, so they
+    would share the open files of the model otherwise.
+    """
+    _init_block_worker(lm.copy())
+
+def _encode_block(tokens):
+    """Encode a block of plaintext to the bits of a subinterval."""
+    return interval2bits(encode(_block_lm.conditional_interval, tokens), "sub")
+
+def _decode_block(bits):
+    """Decode bits of a block of plaintext."""
+    return decode(_block_lm.next, bits2interval(bits)).sequence
+
+def _deep_decode_block(chunk):
+    """
+    Decode bits of a block of stegotext, ending with a whole sentence, using the
+    source of random bits of the block.
+    """
+
+    (bits, rng) = chunk
+
+    return deep_decode(_block_lm.next, bits2interval(bits),
+                       end=_block_lm.end, rng=rng).sequence
+
+def _map_blocks(lm, processes, function, blocks):
+    """
+    Apply a block coding function to blocks, in a pool of worker processes if
+    there is more than one. Each worker opens its own copy of the language
+    model.
+    """
+
+    if processes == 1:
+        _init_block_worker(lm)
+        return tuple(map(function, blocks))
+
+    with multiprocessing.Pool(processes, _init_block_pool_worker,
+                              (lm,)) as pool:
+        return tuple(pool.map(function, blocks, 1))
+
+class BlockSentence(Sentence):
+    """
+    Text coded as a sequence of blocks of whole sentences. Every block is coded
+    independently starting from an empty context, so blocks can be coded in
+    parallel and an error in one block does not affect the others. The text as
+    a whole has no interval.
+    """
+
+    def __init__(self, index, lm, framing, blocks, bits):
+        self.index = index
+        self.lm = lm
+        self.framing = framing
+
+        self.blocks = tuple(blocks)
+        self.token_indices = tuple(itertools.chain.from_iterable(self.blocks))
+        self.token_strings = tuple(map(self.index.i2s, self.token_indices))
+        self.interval = None
+        self.bits = Bits(bits)
+
+    def _description(self):
+        description = super()._description()
+        description["Framing"] = str(self.framing)
+        description["Blocks"] = len(self.blocks)
+
+        return description
+
+class BlockPlaintext(BlockSentence):
+
+    def __init__(self, index, lm, framing, mode, input, processes=1):
+        """
+        Initialise plaintext either from framed bits decrypted from stegotext or
+        directly from text, split into blocks of a fixed number of sentences.
+        """
+
+        assert(mode in ("decode_bits", "save"))
+
+        end = index.s2i("_END_")
+
+        if mode == "decode_bits":
+            bits = input
+            (blocks_bits, last_sentences) = unframe_blocks(bits, framing)
+            decoded = _map_blocks(lm, processes, _decode_block, blocks_bits)
+
+            # Cut off the symbols decoded after the sentences of each block
+            numbers = ([framing.sentences] * (len(decoded)-1) +
+                       [last_sentences])[:len(decoded)]
+            blocks = tuple(
+                tuple(itertools.chain.from_iterable(
+                    split_sentences(sequence, end)[:number]))
+                for (sequence, number) in zip(decoded, numbers)
+            )
+        elif mode == "save":
+            raw_token_strings = text2token_strings(input)
+            token_strings = normalise_and_explode_tokens(raw_token_strings)
+            sentences = split_sentences(map(index.s2i, token_strings), end)
+
+            blocks = tuple(
+                tuple(itertools.chain.from_iterable(
+                    sentences[i:i+framing.sentences]))
+                for i in range(0, len(sentences), framing.sentences)
+            )
+            last_sentences = len(sentences) - framing.sentences * max(
+                len(blocks)-1, 0)
+
+            blocks_bits = _map_blocks(lm, processes, _encode_block, blocks)
+            bits = frame_blocks(blocks_bits, last_sentences, framing)
+
+        super().__init__(index, lm, framing, blocks, bits)
+
+class BlockStegotext(BlockSentence):
+
+    def __init__(self, index, lm, framing, mode, input, processes=1,
+                 rng=None):
+        """
+        Initialise stegotext either from bits encrypted from plaintext or
+        directly from text. Each block carries a chunk of the bits and is
+        decoded with its own child stream of the source of random bits.
+        """
+
+        assert(mode in ("decode_bits", "save"))
+
+        if mode == "decode_bits":
+            if rng is None:
+                rng = make_rng()
+
+            # Pad the bits with random ones to whole chunks
+            bits = Bits(input)
+            bits += random_bits(-len(bits) % framing.chunk_bits, rng=rng)
+
+            chunks = tuple(
+                (bits[i:i+framing.chunk_bits], rng.child(j))
+                for (j, i) in enumerate(range(0, len(bits), framing.chunk_bits))
+            )
+            blocks = _map_blocks(lm, processes, _deep_decode_block, chunks)
+        elif mode == "save":
+            raw_token_strings = text2token_strings(input)
+            token_strings = normalise_and_explode_tokens(raw_token_strings)
+            token_indices = tuple(map(index.s2i, token_strings))
+
+            # Decoding a chunk ends with the first whole sentence whose
+            # interval is a subinterval of the interval of the chunk, i.e. when
+            # the chunk is a prefix of the bits of its smallest superinterval.
+            # Find these points to split the stegotext into blocks.
+            (blocks, bits) = ([], Bits())
+
+            # Settled bits of the current block, None between blocks
+            block_bits = None
+
+            for sentence in split_sentences(token_indices, index.s2i("_END_")):
+                if block_bits is None:
+                    encoder = IncrementalEncoder(lm.conditional_interval,
+                                                 lm.n_max-1)
+                    (block, block_bits) = ((), Bits())
+
+                for token in sentence:
+                    block_bits += encoder.encode(token)
+                block += sentence
+
+                if len(block_bits) >= framing.chunk_bits:
+                    blocks.append(block)
+                    bits += block_bits[:framing.chunk_bits]
+                    block_bits = None
+
+            if block_bits is not None:
+                raise ValueError("Stegotext does not end with a whole block.")
+
+        super().__init__(index, lm, framing, blocks, bits)
+
 class BinaryStegosystem:
     """
     Stegosystem based on mapping sentences to intervals and then to bit
-    sequences.
+    sequences. Optionally, messages are coded as independent blocks with the
+    given framing, which are coded by a number of worker processes.
+
+    Stegotext is generated with random bits from the given source of the
+    session, or from new cryptographically secure sources by default.
     """
 
-    def __init__(self, index, lm):
+    def __init__(self, index, lm, framing=None, processes=1, rng=None):
         self.index = index
         self.lm = lm
+        self.framing = framing
+        self.processes = processes
+        self.rng = rng
 
     def pk2s(self, p, k):
         """Encrypt plaintext with key and return encrypted stegotext."""
 
         bits = encrypt(p.bits, k.bits)
-        return Stegotext(self.index, self.lm, "decode_bits", bits)
+
+        if self.framing is None:
+            return Stegotext(self.index, self.lm, "decode_bits", bits,
+                             self.rng)
+
+        if getattr(p, "framing", None) != self.framing:
+            raise TypeError("Text is not coded as blocks with the framing of "
+                            "the stegosystem.")
+        return BlockStegotext(self.index, self.lm, self.framing, "decode_bits",
+                              bits, self.processes, self.rng)
 
     def sk2p(self, s, k):
         """Decrypt encrypted stegotext with key and return plaintext."""
 
         bits = decrypt(s.bits, k.bits)
-        return Plaintext(self.index, self.lm, "decode_bits", bits)
+
+        if self.framing is None:
+            return Plaintext(self.index, self.lm, "decode_bits", bits)
+
+        if getattr(s, "framing", None) != self.framing:
+            raise TypeError("Text is not coded as blocks with the framing of "
+                            "the stegosystem.")
+        return BlockPlaintext(self.index, self.lm, self.framing, "decode_bits",
+                              bits, self.processes)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+descr = """
+This script will convert a text index file created by the create_index.py script
+to a binary index file. The binary index is memory-mapped instead of parsed, so
+scripts can start using it immediately and processes share its memory. Lookups
+in both formats give identical results.
+"""
+
+import argparse
+
+from pysteg.common.log import print_status
+from pysteg.googlebooks import bindb
+
+# Define and parse arguments
+parser = argparse.ArgumentParser(
+    description=descr,
+    formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("index", help="text index file")
+parser.add_argument("output", help="output path of the binary index")
+args = parser.parse_args()
+
+print_status("Started loading index from", args.index)
+with open(args.index, "r") as f:
+    index = bindb.BinDBIndex(f)
+print_status("Finished loading index")
+
+bindb.write_binary_index(args.output, index)
+print_status("Saved binary index to", args.output)
@@ -18,9 +18,9 @@ import json
 import os
 import struct
 
-from itertools import count
+from itertools import count, islice
 
-from numpy import zeros
+import numpy
 
 from pysteg.common.log import print_status
 
@@ -30,6 +30,56 @@ from pysteg.googlebooks.ngrams_analysis import ngram_filename
 from pysteg.googlebooks.ngrams_analysis import BS_PARTITION_NAMES
 from pysteg.googlebooks.ngrams_analysis import BS_SPECIAL_PREFIXES
 
+def index_chunk(lines, n, part, ngrams, fe):
+    """
+    Translate a chunk of lines of a prefix file to token indices in a single
+    call to the index. Save the ngrams whose tokens are all in the index and
+    whose first token belongs to the partition at the beginning of the ngrams
+    array and write the remaining lines to the error file. Return the number of
+    saved ngrams.
+    """
+
+    # If every line has n tokens and a count, split all lines at once into
+    # fields. Only the total number of fields would not tell a line with too
+    # many fields followed by one with too few from two well-formed lines.
+    if all(line.count("\t") == n for line in lines):
+        fields = "\t".join(line[:-1] for line in lines).split("\t")
+        well_formed = True
+    else:
+        # Split the lines separately and replace the fields of the lines
+        # without n tokens and a count with empty ones
+        rows = [line[:-1].split("\t") for line in lines]
+        well_formed = numpy.array([len(row) == n+1 for row in rows])
+        fields = [f for row in rows
+                    for f in (row if len(row) == n+1 else [""] * (n+1))]
+
+    counts = numpy.array(fields[n::n+1])
+    del fields[n::n+1]
+
+    batch = index.translate_batch(fields)
+
+    indices = numpy.frombuffer(batch.indices, dtype="<i4").reshape(-1, n)
+    valid = numpy.frombuffer(batch.valid, dtype="u1").reshape(-1, n)
+    partitions = numpy.frombuffer(batch.partitions, dtype="<u2").reshape(-1, n)
+
+    # All tokens have to be found and the first one in the right partition
+    accepted = well_formed & valid.all(axis=1)
+    if part in index.partition_names:
+        accepted &= partitions[:,0] == index.partition_names.index(part)
+    else:
+        accepted[:] = False
+
+    saved = int(accepted.sum())
+
+    for i in range(n):
+        ngrams["w{}".format(i)][:saved] = indices[accepted,i]
+    ngrams["f"][:saved] = counts[accepted].astype("<i8")
+
+    for i in numpy.flatnonzero(~accepted):
+        fe.write(lines[i])
+
+    return saved
+
 def write_ngrams_table(n, prefixes):
     """Writes ngrams counts table for a particular n."""
 
@@ -77,7 +127,7 @@ def write_ngrams_table(n, prefixes):
             )
 
             # Create a numpy array that can contain all potential ngrams
-            ngrams = zeros(ngrams_maxn, dtype=dtp)
+            ngrams = numpy.zeros(ngrams_maxn, dtype=dtp)
 
             # Read one by one prefix files corresponding to the partition
             i = 0
@@ -88,20 +138,13 @@ def write_ngrams_table(n, prefixes):
                 input_path = os.path.join(args.input, filename)
                 error_path = os.path.join(args.error, filename)
                 with open(input_path, "r") as fi, open(error_path, "w") as fe:
-                    for line in fi:
-                        ngram = line[:-1].split("\t")
-                        try:
-                            # Translate all tokens to their indices
-                            ixs = tuple(map(index.s2i, ngram[:-1]))
-                            # Assert that the partition is correct
-                            assert(index.s2p(ngram[0]) == part)
-                            # Add the ngram
-                            ngrams[i] = ixs + (int(ngram[-1]),)
-                            i+=1
-                        # If the partition doesn't match or the token cannot be
-                        # found in the index
-                        except (AssertionError, KeyError):
-                            fe.write(line)
+                    # Translate the lines in chunks, discarding those with
+                    # tokens not found in the index or in a wrong partition
+                    while True:
+                        lines = list(islice(fi, args.chunk))
+                        if len(lines) == 0:
+                            break
+                        i += index_chunk(lines, n, part, ngrams[i:], fe)
                 print_status("Read and indexed ngrams from", input_path)
             ngrams_n = i
 
@@ -142,16 +185,17 @@ if __name__ == '__main__':
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument("ngrams", help="JSON file listing all the ngram files")
-    parser.add_argument("index", help="index file")
+    parser.add_argument("index", help="text or binary index file")
     parser.add_argument("input", help="input directory of ngram files")
     parser.add_argument("output", help="output directory of bindb files")
     parser.add_argument("error", help="output directory for discarded ngrams")
+    parser.add_argument("--chunk", metavar="C", type=int, default=1000000,
+        help="set the number of lines translated at once (default 1000000)")
     args = parser.parse_args()
 
     # Read the index of tokens
     print_status("Started loading index from", args.index)
-    with open(args.index, "r") as f:
-        index = bindb.BinDBIndex(f)
+    index = bindb.load_index(args.index)
     print_status("Finished loading index")
 
     # Load the ngram files descriptions
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+descr = """
+This script will create top-k tables for BinDB tables, which allow a BinDB
+language model to find the most probable continuations of a context without
+iterating over all of its successors.
+
+For each ngram order n a top-k table "{n}gram-topk" is saved next to the BinDB
+table "{n}gram". It is a BinDB file of order n which for every context of length
+(n-1), in the order of the BinDB table, contains a block of lines:
+
+3 header lines with pseudo-tokens in place of the last token:
+    -1 with the number of all successors of the context
+    -2 with the total count of all successors of the context
+    -3 with the total count of the ngrams obtained by dropping the first token
+       of the successors (0 for unigrams)
+k lines with the most frequent successors, sorted by descending count
+
+With the --count-order option, every successor of each context is listed and
+the directory is marked as supporting the count coding order -- successors of
+contexts are laid out in the conditional probability intervals by descending
+counts instead of by token indices, so that frequent tokens are found after
+reading only a few lines. Only language models created with
+coding_order="count" use this order, others keep using the token order.
+Messages encoded in one order cannot be decoded in the other.
+
+The input tables need to be counts-consistent.
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+
+from pysteg.common.log import print_status
+from pysteg.googlebooks import bindb
+
+def process_file(n):
+    """Create a top-k table of order n."""
+    ngrams_path = os.path.join(args.bindb, "{n}gram".format(**locals()))
+    topk_path = ngrams_path + "-topk"
+
+    print_status("Creating top-{} table from".format(k), ngrams_path)
+
+    with open(ngrams_path, "rb") as ngrams_f, open(topk_path, "wb") as topk_f:
+        ngrams = bindb.iter_bindb_file(ngrams_f, n)
+
+        for context, successors in itertools.groupby(
+            ngrams, key=lambda l: l.ngram[:-1]
+        ):
+            successors = tuple(successors)
+
+            if n > 1:
+                lower_order_count = sum(lm.count(l.ngram[1:])
+                                        for l in successors)
+            else:
+                lower_order_count = 0
+
+            header = (
+                (bindb.TOPK_SUCCESSORS, len(successors)),
+                (bindb.TOPK_SUCCESSORS_COUNT, sum(l.count for l in successors)),
+                (bindb.TOPK_LOWER_ORDER_COUNT, lower_order_count),
+            )
+
+            for token, count in header:
+                topk_f.write(bindb.pack_line(
+                    bindb.BinDBLine(context + (token,), count), n
+                ))
+
+            key = lambda l: (-l.count, l.ngram[-1])
+
+            if args.count_order:
+                listed = sorted(successors, key=key)
+            else:
+                listed = heapq.nsmallest(args.k, successors, key=key)
+
+            for l in listed:
+                topk_f.write(bindb.pack_line(l, n))
+
+    print_status("Saved top-{} table to".format(k), topk_path)
+
+# Define and parse arguments
+parser = argparse.ArgumentParser(
+    description=descr,
+    formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("n_max", metavar="n", type=int, help="order of the model")
+parser.add_argument("bindb", help="directory of counts-consistent BinDB files")
+parser.add_argument("-k", type=int, default=100,
+    help="number of most frequent successors saved for each context")
+parser.add_argument("--count-order", action="store_true",
+    help="save all successors and use the count coding order")
+args = parser.parse_args()
+
+k = "all" if args.count_order else args.k
+
+# Only raw counts are read from the language model, so the indices of the
+# _START_ and _END_ tokens and the back-off parameters are irrelevant
+lm = bindb.BinDBLM(args.bindb, args.n_max, None, None, 0, 0, 0)
+
+# Process the files
+for n in range(1, args.n_max+1):
+    process_file(n)
+
+if args.count_order:
+    bindb.write_coding_order(args.bindb, "count")
+    print_status("Marked", args.bindb, "as supporting the count order")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+descr = """
+This script will create a warm cache file for a BinDB language model. The file
+stores distributions of the most frequent contexts, which the language model
+can memory-map at startup instead of finding them in the BinDB tables.
+
+Contexts are chosen for each context length separately, either as the most
+frequent ngrams in the BinDB tables or as the most frequently requested
+contexts in a traffic file. Each line of the traffic file lists space separated
+token indices of a single context.
+
+Besides the distribution of each chosen context, the distribution of the level
+reached by backing-off from it is cached. Backed-off unigram levels are not
+cached, since each of them lists almost the whole vocabulary -- the search for
+a token backing-off from a chosen context of length 1 reads the BinDB tables.
+
+The cache can only be used with a language model with the same fingerprint,
+i.e. with the same parameters and unchanged BinDB tables.
+"""
+
+import argparse
+import collections
+import heapq
+
+from pysteg.common.listtools import take
+from pysteg.common.log import print_status
+from pysteg.googlebooks import bindb
+
+def contexts_from_counts(k):
+    """Return the k most frequent ngrams of each order below n_max."""
+
+    contexts = []
+
+    for n in range(1, args.n_max):
+        ngrams = bindb.iter_bindb_file(lm.f[n], n)
+        contexts.extend(l.ngram for l in heapq.nlargest(
+            k, ngrams, key=lambda l: l.count))
+        print_status("Found most frequent contexts of length", n)
+
+    return contexts
+
+def contexts_from_traffic(path, k):
+    """Return the k most frequently requested contexts of each length."""
+
+    counts = collections.defaultdict(collections.Counter)
+
+    with open(path, "r") as f:
+        for line in f:
+            context = take(tuple(map(int, line.split())), -(args.n_max-1))
+            counts[len(context)][context] += 1
+
+    return [context for m in sorted(counts)
+                    for (context, count) in counts[m].most_common(k)]
+
+# Define and parse arguments
+parser = argparse.ArgumentParser(
+    description=descr,
+    formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("index", help="text or binary index file")
+parser.add_argument("bindb", help="directory of BinDB files")
+parser.add_argument("n_max", metavar="n", type=int, help="order of the model")
+parser.add_argument("beta", type=float, help="back-off beta parameter")
+parser.add_argument("gamma", type=float, help="back-off gamma parameter")
+parser.add_argument("offset", type=int, help="count offset parameter")
+parser.add_argument("output", help="output path of the warm cache")
+parser.add_argument("-k", type=int, default=1000,
+    help="number of cached contexts of each length")
+parser.add_argument("-t", "--traffic",
+    help="choose contexts from a traffic file instead of ngram counts")
+parser.add_argument("--coding-order", choices=("token", "count"),
+    default="token",
+    help="set the coding order of the successors of contexts (default token)")
+args = parser.parse_args()
+
+print_status("Started loading index from", args.index)
+index = bindb.load_index(args.index)
+print_status("Finished loading index")
+
+lm = bindb.BinDBLM(args.bindb, args.n_max, index.s2i("_START_"),
+                   index.s2i("_END_"), args.beta, args.gamma, args.offset,
+                   coding_order=args.coding_order)
+
+if args.traffic:
+    contexts = contexts_from_traffic(args.traffic, args.k)
+else:
+    contexts = contexts_from_counts(args.k)
+
+# Levels of the chosen contexts and of their back-off, except unigram levels
+levels = set((context, None) for context in contexts)
+levels.update((context[1:], context[0]) for context in contexts
+              if len(context) > 1)
+
+bindb.write_warm_cache(args.output, lm, levels)
+print_status("Saved", len(levels), "cached levels of", len(contexts),
+             "contexts to", args.output)
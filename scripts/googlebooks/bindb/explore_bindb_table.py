@@ -28,8 +28,7 @@ args = parser.parse_args()
 
 if args.index:
     print_status("Started loading index from", args.index)
-    with open(args.index, "r") as f:
-        index = bindb.BinDBIndex(f)
+    index = bindb.load_index(args.index)
     print_status("Finished loading index")
 
 # Patterns of the range definitions
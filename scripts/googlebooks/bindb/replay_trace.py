@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+descr = """
+This script will replay a query trace recorded by a BinDB language model created
+with the trace parameter. Each recorded call is repeated in the same order
+through the public methods of a language model with the given BinDB tables and
+configuration, including all of its caches, so that storage and caching changes
+can be evaluated on real traffic.
+
+The search interval of a next token search is not recorded. It is replaced by
+the conditional probability interval of the found token, computed beforehand by
+a separate model, so that the search follows the recorded back-off path. A
+search which found no token is replayed with the whole unit interval.
+
+The script reports the throughput and latency percentiles of the replayed calls,
+together with the latencies of the calls and level lookups originally recorded.
+"""
+
+import argparse
+import time
+
+from pysteg.coding.interval import create_interval
+from pysteg.common.log import print_status
+from pysteg.googlebooks import bindb
+
+def percentiles(durations, ps=(50, 90, 99, 100)):
+    """Return the nearest-rank percentiles of durations in milliseconds."""
+
+    durations = sorted(durations)
+
+    if len(durations) == 0:
+        return tuple(float("nan") for p in ps)
+
+    return tuple(1000 * durations[max(0, -(-p*len(durations)//100) - 1)]
+                 for p in ps)
+
+def report(name, durations, total):
+    """Print the throughput and latency percentiles of replayed operations."""
+
+    throughput = len(durations) / total if total > 0 else float("nan")
+
+    print("{}: {} in {:.3f} s, {:.1f} per second".format(
+        name, len(durations), total, throughput))
+    print("    latency p50 {:.3f} ms, p90 {:.3f} ms, p99 {:.3f} ms, "
+          "max {:.3f} ms".format(*percentiles(durations)))
+
+# Define and parse arguments
+parser = argparse.ArgumentParser(
+    description=descr,
+    formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("index", help="text or binary index file")
+parser.add_argument("bindb", help="directory of BinDB files")
+parser.add_argument("n_max", metavar="n", type=int, help="order of the model")
+parser.add_argument("beta", type=float, help="back-off beta parameter")
+parser.add_argument("gamma", type=float, help="back-off gamma parameter")
+parser.add_argument("offset", type=int, help="count offset parameter")
+parser.add_argument("trace", help="query trace file")
+parser.add_argument("--warm-cache", help="use a warm cache file")
+parser.add_argument("--prefetch-contexts", metavar="C", type=int, default=0,
+    help="prefetch the distributions of C most probable next contexts")
+parser.add_argument("--prefetch-threads", metavar="T", type=int, default=2,
+    help="set the number of prefetching threads (default 2)")
+parser.add_argument("--interval-cache",
+    help="use a persistent cache of intervals in an SQLite database")
+parser.add_argument("--interval-cache-size", metavar="S", type=int,
+    default=1000000,
+    help="set the maximum number of cached intervals (default 1000000)")
+parser.add_argument("--coding-order", choices=("token", "count"),
+    default="token",
+    help="set the coding order of the successors of contexts (default token)")
+args = parser.parse_args()
+
+print_status("Started loading index from", args.index)
+index = bindb.load_index(args.index)
+print_status("Finished loading index")
+
+(start, end) = (index.s2i("_START_"), index.s2i("_END_"))
+
+lm = bindb.BinDBLM(args.bindb, args.n_max, start, end, args.beta, args.gamma,
+                   args.offset, coding_order=args.coding_order,
+                   prefetch_contexts=args.prefetch_contexts,
+                   prefetch_threads=args.prefetch_threads,
+                   warm_cache=args.warm_cache,
+                   interval_cache=args.interval_cache,
+                   interval_cache_size=args.interval_cache_size)
+
+# Model without any persistent caches for finding the search intervals, so that
+# the caches of the replayed model are not warmed up by it
+search_lm = bindb.BinDBLM(args.bindb, args.n_max, start, end, args.beta,
+                          args.gamma, args.offset,
+                          coding_order=args.coding_order)
+
+print_status("Started replaying", args.trace)
+
+calls = []
+(recorded_calls, recorded_levels) = ([], [])
+
+for record in bindb.iter_trace_file(args.trace):
+    if record.kind == bindb.TRACE_NEXT:
+        if record.token is None:
+            interval = create_interval(0, 1)
+        else:
+            interval = search_lm.conditional_interval(record.token,
+                                                      record.context)
+
+        call_start = time.perf_counter()
+        lm.next(interval, record.context)
+    else:
+        call_start = time.perf_counter()
+        lm.conditional_interval(record.token, record.context)
+
+    calls.append(time.perf_counter() - call_start)
+
+    recorded_calls.append(record.duration)
+    recorded_levels.extend(level.duration for level in record.levels)
+
+print_status("Finished replaying", args.trace)
+
+report("Replayed calls", calls, sum(calls))
+report("Recorded calls", recorded_calls, sum(recorded_calls))
+report("Recorded level lookups", recorded_levels, sum(recorded_levels))
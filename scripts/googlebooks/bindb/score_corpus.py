@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+descr = """
+This script will evaluate a BinDB language model on a corpus of text. Each line
+of the corpus file is a separate text, with sentences delimited by more than one
+whitespace character.
+
+Log-probabilities of tokens are computed in floating point by batches of lines
+in parallel worker processes. The script reports the entropy (bits per token),
+perplexity and the rate of out-of-vocabulary tokens. The context is reset at
+each out-of-vocabulary token, so that the tokens around it are not scored as
+neighbours. The token directly following it has no context and is skipped.
+_START_ tokens are not counted, since their probability is always 1.
+"""
+
+import argparse
+import itertools
+import math
+import multiprocessing
+
+from pysteg.common.listtools import take
+from pysteg.common.log import print_status
+from pysteg.googlebooks import bindb
+from pysteg.googlebooks.ngrams_analysis import normalise_and_explode_tokens
+from pysteg.googlebooks.ngrams_analysis import text2token_strings
+
+def init_worker(worker_index, model):
+    """
+    Set the index and a copy of the language model used by score_lines in a
+    worker process. Forked workers would share the open files of the model
+    otherwise. With the spawn start method the index is pickled -- a binary
+    index is mapped again in each worker.
+    """
+    global index, lm
+    (index, lm) = (worker_index, model.copy())
+
+def score_lines(lines):
+    """
+    Score a batch of lines. Return the number of scored tokens, their total
+    log-probability, the number of out-of-vocabulary tokens, the number of
+    impossible tokens, which are excluded from the total, and the number of
+    tokens skipped after out-of-vocabulary tokens.
+    """
+
+    pairs = []
+    (oov, skipped) = (0, 0)
+
+    for line in lines:
+        token_strings = normalise_and_explode_tokens(text2token_strings(line))
+
+        # Tokens since the start of the line or the last out-of-vocabulary
+        # token, within the order of the model
+        context = ()
+
+        for s in token_strings:
+            try:
+                token = index.s2i(s)
+            except KeyError:
+                oov += 1
+                context = ()
+                continue
+
+            if token != lm.start:
+                if len(context) > 0:
+                    pairs.append((token, context))
+                else:
+                    skipped += 1
+
+            context = take(context + (token,), -(lm.n_max-1))
+
+    logprobs = lm.log2_probabilities(pairs)
+    possible = tuple(p for p in logprobs if p != float("-inf"))
+
+    return (len(possible), sum(possible), oov, len(logprobs) - len(possible),
+            skipped)
+
+def batches(f, size):
+    """Generate batches of non-empty lines of a file."""
+
+    lines = (l for l in f if not l.isspace())
+
+    while True:
+        batch = tuple(itertools.islice(lines, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+if __name__ == '__main__':
+    # Define and parse arguments
+    parser = argparse.ArgumentParser(
+        description=descr,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("index", help="text or binary index file")
+    parser.add_argument("bindb", help="directory of BinDB files")
+    parser.add_argument("n_max", metavar="n", type=int,
+                        help="order of the model")
+    parser.add_argument("beta", type=float, help="back-off beta parameter")
+    parser.add_argument("gamma", type=float, help="back-off gamma parameter")
+    parser.add_argument("offset", type=int, help="count offset parameter")
+    parser.add_argument("corpus", help="corpus file")
+    parser.add_argument("--batch", metavar="B", type=int, default=1000,
+        help="set the number of lines scored in one batch (default 1000)")
+    parser.add_argument("--processes", metavar="P", type=int, default=1,
+        help="set the number of parallel worker processes (default 1)")
+    args = parser.parse_args()
+
+    # The index is loaded before starting the workers, so that they can share it
+    print_status("Started loading index from", args.index)
+    index = bindb.load_index(args.index)
+    print_status("Finished loading index")
+
+    lm = bindb.BinDBLM(args.bindb, args.n_max, index.s2i("_START_"),
+                       index.s2i("_END_"), args.beta, args.gamma, args.offset)
+
+    with open(args.corpus, "r") as f:
+        if args.processes == 1:
+            init_worker(index, lm)
+            results = map(score_lines, batches(f, args.batch))
+        else:
+            pool = multiprocessing.Pool(args.processes, init_worker,
+                                        (index, lm))
+            results = pool.imap(score_lines, batches(f, args.batch))
+
+        (tokens, logprob, oov, impossible, skipped) = (0, 0, 0, 0, 0)
+
+        for result in results:
+            tokens += result[0]
+            logprob += result[1]
+            oov += result[2]
+            impossible += result[3]
+            skipped += result[4]
+            print_status("Scored", tokens, "tokens")
+
+    # Nothing might have been scored, e.g. in an empty corpus
+    total = tokens + impossible + oov + skipped
+    entropy = -logprob / tokens if tokens > 0 else float("nan")
+    perplexity = math.pow(2, entropy)
+    oov_rate = oov / total if total > 0 else float("nan")
+
+    print("Scored tokens: {tokens}".format(**locals()))
+    print("Impossible tokens: {impossible}".format(**locals()))
+    print("Skipped tokens: {skipped}".format(**locals()))
+    print("Out-of-vocabulary tokens: {oov}".format(**locals()))
+    print("Out-of-vocabulary rate: {oov_rate:.4f}".format(**locals()))
+    print("Entropy: {entropy:.4f} bits per token".format(**locals()))
+    print("Perplexity: {perplexity:.2f}".format(**locals()))
@@ -5,7 +5,12 @@ This script will translate all words in Google Books Ngrams files to integer
 indices.
 
 Each line of the index file line has to consist of an integer and a
-corresponding word, separated by a tab.
+corresponding word, separated by a tab. The integers have to go from 1 to the
+number of words.
+
+The index is converted to a temporary binary index file, which is memory-mapped
+by the worker processes. Its pages are shared by all the workers, so memory use
+does not grow with the number of processes.
 """
 
 import argparse
@@ -13,8 +18,10 @@ import functools
 import json
 import multiprocessing
 import os
+import tempfile
 
 from pysteg.common.files import open_file_to_process, FileAlreadyProcessed
+from pysteg.googlebooks import bindb
 from pysteg.googlebooks.psql import get_partition
 from pysteg.googlebooks.ngrams_analysis import gen_ngram_descriptions
 
@@ -26,6 +33,20 @@ def read_index(index_file):
     ))
     return index
 
+def write_binary_index(index_file, path):
+    """
+    Convert the index file to a binary index file, which can be shared by the
+    worker processes. Words of the index have no partitions.
+    """
+
+    index = read_index(index_file)
+
+    words = sorted(index, key=lambda w: int(index[w]))
+    if any(int(index[w]) != i for (i, w) in enumerate(words, 1)):
+        raise ValueError("Indices of the index file are not 1 to V.")
+
+    bindb.write_binary_index_tokens(path, words, ("",), [0] * len(words))
+
 def process_file(descr):
     """Translate words into indices in a single file."""
     n, prefix = descr
@@ -49,7 +70,7 @@ def process_file(descr):
             for line in i:
                 try:
                     l = line.split("\t")
-                    l[:-1] = [index[w] for w in l[:-1]]
+                    l[:-1] = [str(index.s2i(w)) for w in l[:-1]]
 
                     # Check if the first word of the ngram satisfies partition
                     # index constraint
@@ -91,10 +112,16 @@ if __name__ == '__main__':
         help="set the number of parallel worker processes (default 1)")
     args = parser.parse_args()
 
-    # Read the index of words
-    index = read_index(args.index)
+    # Convert the index of words to a binary index, which is opened before
+    # starting the workers, so that they share its memory-mapped pages
+    index_dir = tempfile.TemporaryDirectory()
+    index_path = os.path.join(index_dir.name, "index.bin")
+
+    write_binary_index(args.index, index_path)
     args.index.close()
 
+    index = bindb.BinDBBinaryIndex(index_path)
+
     # Load index ranges
     with open(args.index_ranges, "r") as f:
         index_ranges = json.load(f)
@@ -127,3 +154,5 @@ if __name__ == '__main__':
         **locals()))
     print("Ngrams in bad partitions discarded: {total_bad_partition}".format(
         **locals()))
+
+    index_dir.cleanup()
@@ -0,0 +1,133 @@
+import collections
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from pysteg.googlebooks import bindb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Small BinDB database built from a random corpus, shared by all tests
+BinDBFixture = collections.namedtuple("BinDBFixture",
+    "path index start end sentences")
+
+WORDS = ("the of and a to in is you that it he was for on are as with his they "
+         "i at be this have from or one had by word but not what all were we "
+         "when your can said there use an each which she do how their if will "
+         "up other about out many then them these so some her would make like "
+         "him into time has look two more write go see number no way could "
+         "people my than first water been call who oil its now find long down "
+         "day did get come made may part , . ? !").split()
+
+def make_corpus(size, seed):
+    """
+    Generate sentences of token strings, with Zipfian word frequencies and some
+    dependence of words on the previous ones.
+    """
+
+    rng = random.Random(seed)
+    weights = [1/(i+1) for i in range(len(WORDS))]
+
+    sentences = []
+
+    for s in range(size):
+        sentence = []
+
+        for j in range(rng.randint(2, 12)):
+            if len(sentence) > 0 and rng.random() < 0.5:
+                w = WORDS[(WORDS.index(sentence[-1]) * 7 + 3) % len(WORDS)]
+            else:
+                w = rng.choices(WORDS, weights)[0]
+            sentence.append(w)
+
+        sentences.append(["_START_"] + sentence + ["_END_"])
+
+    return sentences
+
+def write_bindb(path, sentences, n_max):
+    """Write the index and counts-consistent BinDB tables of a corpus."""
+
+    vocabulary = sorted(set(w for s in sentences for w in s))
+    s2i = dict((w, i) for (i, w) in enumerate(vocabulary, 1))
+
+    with open(os.path.join(path, "index"), "w") as f:
+        for (i, w) in enumerate(vocabulary, 1):
+            f.write("{}\t{}\t_\n".format(i, w))
+
+    for n in range(1, n_max+1):
+        counts = collections.Counter()
+
+        for s in sentences:
+            indices = tuple(s2i[w] for w in s)
+            for k in range(len(indices)-n+1):
+                counts[indices[k:k+n]] += 1
+
+        with open(os.path.join(path, "{}gram".format(n)), "wb") as f:
+            for ngram in sorted(counts):
+                f.write(bindb.pack_line(bindb.BinDBLine(ngram, counts[ngram]),
+                                        n))
+
+@pytest.fixture(scope="session")
+def bindb_fixture(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("bindb"))
+    sentences = make_corpus(1000, seed=1)
+    write_bindb(path, sentences, 5)
+
+    with open(os.path.join(path, "index"), "r") as f:
+        index = bindb.BinDBIndex(f)
+
+    return BinDBFixture(
+        path, index, index.s2i("_START_"), index.s2i("_END_"),
+        tuple(tuple(map(index.s2i, s)) for s in sentences)
+    )
+
+@pytest.fixture
+def lm(bindb_fixture):
+    return bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                         bindb_fixture.end, 0.1, 0.01, 0)
+
+def run_script(name, *args):
+    """Run a BinDB script of the repository with the given arguments."""
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable,
+                    os.path.join(ROOT, "scripts", "googlebooks", "bindb", name)]
+                   + [str(arg) for arg in args],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+@pytest.fixture(scope="session")
+def topk_fixture(bindb_fixture):
+    # Top-k tables listing every successor, so that top-k queries are exact
+    run_script("create_topk_index.py", 5, bindb_fixture.path, "-k", 1000)
+    return bindb_fixture
+
+def copy_bindb(bindb_fixture, path):
+    """Copy the index and the BinDB tables, without top-k tables, to path."""
+
+    os.makedirs(path, exist_ok=True)
+
+    for name in os.listdir(bindb_fixture.path):
+        if not name.endswith("-topk"):
+            shutil.copy(os.path.join(bindb_fixture.path, name), path)
+
+    return bindb_fixture._replace(path=path)
+
+@pytest.fixture(scope="session")
+def truncated_topk_fixture(bindb_fixture, tmp_path_factory):
+    # Copy of the database with top-k tables listing few successors
+    fixture = copy_bindb(bindb_fixture,
+                         str(tmp_path_factory.mktemp("bindb-truncated")))
+    run_script("create_topk_index.py", 5, fixture.path, "-k", 3)
+    return fixture
+
+@pytest.fixture(scope="session")
+def count_order_fixture(bindb_fixture, tmp_path_factory):
+    # Copy of the database with complete top-k tables for the count order
+    fixture = copy_bindb(bindb_fixture,
+                         str(tmp_path_factory.mktemp("bindb-count")))
+    run_script("create_topk_index.py", 5, fixture.path, "--count-order")
+    return fixture
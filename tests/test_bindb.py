@@ -0,0 +1,191 @@
+import concurrent.futures
+import math
+import pickle
+
+import pytest
+
+from pysteg.coding import range_coder
+from pysteg.coding.interval import random_interval
+from pysteg.coding.rational_ac import batch_encode
+from pysteg.coding.rational_ac import decode
+from pysteg.coding.rational_ac import deep_decode
+from pysteg.coding.rational_ac import encode
+from pysteg.googlebooks import bindb
+from tests.conftest import copy_bindb
+
+def outcome(f, *args, **kwargs):
+    """Return the result of a call or the type of the exception it raised."""
+
+    try:
+        return f(*args, **kwargs)
+    except Exception as e:
+        return type(e)
+
+@pytest.fixture
+def exact_lm(bindb_fixture):
+    return bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                         bindb_fixture.end, 0.1, 0.01, 0, next_search="exact")
+
+def test_decode_round_trip(lm, bindb_fixture):
+    for sentence in bindb_fixture.sentences[:20]:
+        interval = encode(lm.conditional_interval, sentence)
+
+        assert decode(lm.next, interval).sequence[:len(sentence)] == sentence
+        assert deep_decode(lm.next, interval, end=lm.end,
+                           seed=0).sequence == sentence
+
+def test_next_search_strategies_agree(lm, exact_lm):
+    for seed in range(30):
+        interval = random_interval(64, seed=seed)
+
+        assert (outcome(decode, lm.next, interval) ==
+                outcome(decode, exact_lm.next, interval))
+        assert (outcome(deep_decode, lm.next, interval, end=lm.end, seed=seed)
+                == outcome(deep_decode, exact_lm.next, interval,
+                           end=exact_lm.end, seed=seed))
+
+def test_conditional_intervals(lm, bindb_fixture):
+    sentences = bindb_fixture.sentences[:20]
+    pairs = tuple((sentence[i], sentence[:i])
+                  for sentence in sentences for i in range(len(sentence)))
+
+    assert lm.conditional_intervals(pairs) == tuple(
+        lm.conditional_interval(token, context) for (token, context) in pairs)
+    assert batch_encode(lm.conditional_intervals, sentences) == tuple(
+        encode(lm.conditional_interval, sentence) for sentence in sentences)
+
+def test_log2_probabilities(lm, bindb_fixture):
+    sentence = bindb_fixture.sentences[0]
+    pairs = tuple((sentence[i], sentence[:i]) for i in range(len(sentence)))
+
+    for ((token, context), logprob) in zip(pairs,
+                                           lm.log2_probabilities(pairs)):
+        interval = lm.conditional_interval(token, context)
+        assert logprob == pytest.approx(math.log2(interval.l))
+
+def test_range_coder_round_trip(lm, bindb_fixture):
+    for sentence in bindb_fixture.sentences[:20]:
+        bits = range_coder.encode(lm.conditional_counts, sentence)
+
+        assert range_coder.decode(lm.next_counts, bits,
+                                  end=lm.end) == sentence
+
+        # Bits returned by the steps of an encoder make up the same code
+        encoder = range_coder.RangeEncoder()
+        chunks = [encoder.encode(count_interval)
+                  for i in range(len(sentence))
+                  for count_interval in lm.conditional_counts(sentence[i],
+                                                              sentence[:i])]
+        assert sum(chunks, ()) + encoder.finish() == bits
+
+def test_top_k_indexed(lm, topk_fixture):
+    topk_lm = bindb.BinDBLM(topk_fixture.path, 4, topk_fixture.start,
+                            topk_fixture.end, 0.1, 0.01, 0, topk=True)
+
+    for sentence in topk_fixture.sentences[:20]:
+        for i in range(1, len(sentence)):
+            for k in (1, 5, 20):
+                assert topk_lm.top_k(sentence[:i], k) == lm.top_k(
+                    sentence[:i], k)
+
+def test_top_k_truncated(lm, truncated_topk_fixture):
+    topk_lm = bindb.BinDBLM(truncated_topk_fixture.path, 4,
+                            truncated_topk_fixture.start,
+                            truncated_topk_fixture.end, 0.1, 0.01, 0,
+                            topk=True)
+
+    # Queries for more tokens than listed agree with scanning the tables
+    for sentence in truncated_topk_fixture.sentences[:50]:
+        for i in range(1, len(sentence)):
+            for k in (1, 3, 10):
+                assert topk_lm.top_k(sentence[:i], k) == lm.top_k(
+                    sentence[:i], k)
+
+def test_warm_cache(lm, bindb_fixture, tmp_path):
+    path = str(tmp_path / "warm")
+    sentences = bindb_fixture.sentences[:20]
+
+    levels = set()
+    for sentence in sentences:
+        for i in range(2, len(sentence)):
+            context = sentence[max(0, i-3):i]
+            levels.update(((context, None), (context[1:], context[0])))
+
+    bindb.write_warm_cache(path, lm, levels)
+
+    warm_lm = bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                            bindb_fixture.end, 0.1, 0.01, 0, warm_cache=path)
+
+    for (context, backed_off) in levels:
+        assert warm_lm.warm_cache.get(context, backed_off) == tuple(
+            lm.iter_matching_tokens(context, backed_off))
+
+    for sentence in sentences:
+        interval = encode(warm_lm.conditional_interval, sentence)
+        assert interval == encode(lm.conditional_interval, sentence)
+        assert (decode(warm_lm.next, interval) ==
+                decode(lm.next, interval))
+
+    # Copies of the tables, with new modification times, can use the cache
+    copy_path = str(tmp_path / "copy")
+    copy_bindb(bindb_fixture, copy_path)
+    copy_lm = bindb.BinDBLM(copy_path, 4, bindb_fixture.start,
+                            bindb_fixture.end, 0.1, 0.01, 0, warm_cache=path)
+    assert copy_lm.fingerprint() == lm.fingerprint()
+
+    # Models with different parameters cannot use the cache
+    with pytest.raises(ValueError):
+        bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                      bindb_fixture.end, 0.2, 0.01, 0, warm_cache=path)
+
+def test_interval_cache_threads(lm, bindb_fixture, tmp_path):
+    path = str(tmp_path / "intervals.sqlite")
+    sentences = bindb_fixture.sentences[:50]
+    expected = tuple(encode(lm.conditional_interval, s) for s in sentences)
+
+    def encode_all(cached_lm):
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            return tuple(executor.map(
+                lambda s: encode(cached_lm.conditional_interval, s), sentences))
+
+    for run in range(2):
+        cached_lm = bindb.BinDBLM(
+            bindb_fixture.path, 4, bindb_fixture.start, bindb_fixture.end,
+            0.1, 0.01, 0, interval_cache=path, interval_cache_size=100)
+
+        # Flush often so that the threads also write to the database
+        cached_lm.interval_cache.flush_interval = 10
+
+        assert encode_all(cached_lm) == expected
+        cached_lm.interval_cache.close()
+
+def test_prefetch(lm, bindb_fixture):
+    prefetch_lm = bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                                bindb_fixture.end, 0.1, 0.01, 0,
+                                prefetch_contexts=4, prefetch_threads=4)
+
+    for seed in range(10):
+        interval = random_interval(64, seed=seed)
+        assert (deep_decode(prefetch_lm.next, interval, end=lm.end, seed=seed)
+                == deep_decode(lm.next, interval, end=lm.end, seed=seed))
+
+    prefetch_lm.prefetcher.shutdown()
+
+    statistics = prefetch_lm.bs_statistics()
+    assert sum(searches for (searches, probes) in statistics.values()) == sum(
+        prefetch_lm.bs_searches.values())
+
+def test_pickle(lm, bindb_fixture, tmp_path):
+    path = str(tmp_path / "index.bin")
+    bindb.write_binary_index(path, bindb_fixture.index)
+
+    # Worker processes get copies of the index and the model opened again
+    index = pickle.loads(pickle.dumps(bindb.load_index(path)))
+    for t in bindb_fixture.index.index_tuple:
+        assert index.i2s(index.s2i(t)) == t
+        assert index.s2i(t) == bindb_fixture.index.s2i(t)
+
+    copy = pickle.loads(pickle.dumps(lm))
+    sentence = bindb_fixture.sentences[0]
+    assert encode(copy.conditional_interval, sentence) == encode(
+        lm.conditional_interval, sentence)
@@ -0,0 +1,33 @@
+from pysteg.coding.rational_ac import encode
+from pysteg.googlebooks.bindb_sampler import BinDBSampler
+
+def test_cache_size(lm):
+    sentences = tuple(BinDBSampler(lm, seed=0).sentences(50))
+
+    # Evicting alias tables does not change the drawn tokens
+    sampler = BinDBSampler(lm, cache_size=100, seed=0)
+    assert tuple(sampler.sentences(50)) == sentences
+    assert sampler._cached_tokens <= 100 or len(sampler._tables) == 1
+
+    for sentence in sentences:
+        assert sentence[0] == lm.start and sentence[-1] == lm.end
+        encode(lm.conditional_interval, sentence)
+
+def test_unigram_rejection(lm):
+    sampler = BinDBSampler(lm, seed=0)
+    accepted = {}
+
+    for backed_off in range(1, lm.size[1]+1):
+        accepted[backed_off] = dict(
+            (t.token, t.l) for t in lm.iter_matching_tokens((), backed_off)
+            if t.l > 0)
+
+        for i in range(100):
+            assert sampler._draw_unigram(backed_off) in accepted[backed_off]
+
+    # Only levels accepting few unigrams get their own tables
+    unigram_total = sampler._unigram_table.total
+
+    for (context, backed_off) in sampler._tables:
+        assert context == ()
+        assert sum(accepted[backed_off].values()) < unigram_total / 10
@@ -0,0 +1,35 @@
+import pytest
+
+from pysteg.common.bits import Bits
+from pysteg.crypto import KeyTooShortError
+from pysteg.crypto import decrypt
+from pysteg.crypto import encrypt
+from pysteg.crypto import random_bits
+
+def test_bits_compare_with_tuples():
+    for n in range(20):
+        bits = tuple(random_bits(n, seed=n))
+
+        assert Bits(bits) == bits
+        assert bits == Bits(bits)
+        assert Bits(bits) == list(bits)
+        assert hash(Bits(bits)) == hash(bits)
+        assert {bits: n}[Bits(bits)] == n
+
+    assert Bits((0, 1)) != (0, 1, 0)
+    assert Bits((0, 1)) != (1, 1)
+
+def test_encrypt():
+    plaintext = (1, 0, 1, 1, 0)
+    key = (1, 1)
+
+    assert encrypt(plaintext, key) == (0, 1, 0, 0, 1)
+    assert decrypt(encrypt(plaintext, key), key) == plaintext
+
+    with pytest.raises(KeyTooShortError):
+        encrypt(plaintext, key, strict=True)
+
+    # An empty key cannot be cycled
+    assert encrypt((), ()) == ()
+    with pytest.raises(KeyTooShortError):
+        encrypt(plaintext, ())
@@ -0,0 +1,61 @@
+import pytest
+
+from pysteg.coding import range_coder
+from pysteg.coding.interval import random_interval
+from pysteg.coding.rational_ac import decode
+from pysteg.coding.rational_ac import deep_decode
+from pysteg.coding.rational_ac import encode
+from pysteg.googlebooks import bindb
+
+@pytest.fixture
+def count_lm(count_order_fixture):
+    return bindb.BinDBLM(count_order_fixture.path, 4,
+                         count_order_fixture.start, count_order_fixture.end,
+                         0.1, 0.01, 0, coding_order="count")
+
+def test_opt_in(lm, count_lm, count_order_fixture, bindb_fixture):
+    # Marked directories still use the token order by default
+    token_lm = bindb.BinDBLM(count_order_fixture.path, 4,
+                             count_order_fixture.start,
+                             count_order_fixture.end, 0.1, 0.01, 0)
+    assert not token_lm.count_order and count_lm.count_order
+
+    for sentence in bindb_fixture.sentences[:10]:
+        assert encode(token_lm.conditional_interval, sentence) == encode(
+            lm.conditional_interval, sentence)
+
+    assert token_lm.fingerprint() != count_lm.fingerprint()
+
+    with pytest.raises(ValueError):
+        bindb.BinDBLM(bindb_fixture.path, 4, bindb_fixture.start,
+                      bindb_fixture.end, 0.1, 0.01, 0, coding_order="count")
+
+def test_same_distributions(lm, count_lm, bindb_fixture):
+    for sentence in bindb_fixture.sentences[:20]:
+        for i in range(len(sentence)):
+            assert count_lm.conditional_interval(
+                sentence[i], sentence[:i]).l == lm.conditional_interval(
+                    sentence[i], sentence[:i]).l
+
+def test_round_trip(count_lm, bindb_fixture):
+    for sentence in bindb_fixture.sentences[:20]:
+        interval = encode(count_lm.conditional_interval, sentence)
+        assert decode(count_lm.next, interval).sequence[:len(sentence)] == (
+            sentence)
+
+        bits = range_coder.encode(count_lm.conditional_counts, sentence)
+        assert range_coder.decode(count_lm.next_counts, bits,
+                                  end=count_lm.end) == sentence
+
+def test_next_search_strategies_agree(count_lm, count_order_fixture):
+    exact_lm = bindb.BinDBLM(count_order_fixture.path, 4,
+                             count_order_fixture.start,
+                             count_order_fixture.end, 0.1, 0.01, 0,
+                             next_search="exact", coding_order="count")
+
+    for seed in range(10):
+        interval = random_interval(64, seed=seed)
+        assert deep_decode(count_lm.next, interval, end=count_lm.end,
+                           seed=seed) == deep_decode(exact_lm.next, interval,
+                                                     end=exact_lm.end,
+                                                     seed=seed)
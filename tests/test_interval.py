@@ -0,0 +1,79 @@
+import pytest
+
+from pysteg.coding import interval
+from pysteg.coding.interval import bits2interval
+from pysteg.coding.interval import create_interval
+from pysteg.coding.interval import interval2bit
+from pysteg.coding.interval import interval2bits
+from pysteg.coding.interval import random_interval
+from pysteg.coding.interval import select_subinterval
+from pysteg.coding.rational_ac import EncodingTrie
+from pysteg.coding.rational_ac import encode
+from pysteg.crypto import random_bits
+
+def interval2bits_bitwise(i, mode):
+    """Reference conversion peeling the bits one by one with interval2bit."""
+
+    bits = []
+    result = interval2bit(i, mode)
+
+    while result is not None:
+        (bit, i) = result
+        bits.append(bit)
+        result = interval2bit(i, mode)
+
+    return tuple(bits)
+
+@pytest.fixture(params=sorted(interval.BACKENDS))
+def backend(request):
+    interval.set_backend(request.param)
+    yield request.param
+    interval.set_backend("sympy")
+
+def test_interval2bits_matches_bitwise(backend):
+    intervals = [create_interval(0, 1), create_interval(1, 1, 2),
+                 create_interval(1, 1, 3), create_interval(2, 1, 3)]
+
+    for seed in range(50):
+        intervals.append(select_subinterval(random_interval(40, seed=seed),
+                                            create_interval(1, 7, 10)))
+
+    for i in intervals:
+        for mode in ("sub", "super"):
+            assert tuple(interval2bits(i, mode)) == interval2bits_bitwise(i,
+                                                                          mode)
+
+def test_bits2interval_round_trip(backend):
+    for n in range(20):
+        bits = random_bits(n, seed=n)
+
+        for mode in ("sub", "super"):
+            assert interval2bits(bits2interval(bits), mode) == bits
+
+def test_backends_agree():
+    intervals = {}
+
+    for name in interval.BACKENDS:
+        interval.set_backend(name)
+        intervals[name] = select_subinterval(random_interval(30, seed=0),
+                                             create_interval(2, 3, 7))
+
+    interval.set_backend("sympy")
+
+    assert intervals["fraction"] == intervals["sympy"]
+
+def test_backend_change_clears_caches(lm, bindb_fixture):
+    sentences = bindb_fixture.sentences[:10]
+    trie = EncodingTrie(lm.conditional_interval)
+
+    try:
+        for name in ("sympy", "fraction", "sympy"):
+            interval.set_backend(name)
+
+            for sentence in sentences:
+                for encoded in (encode(lm.conditional_interval, sentence),
+                                trie.encode(sentence)):
+                    assert isinstance(encoded.b, interval.BACKENDS[name])
+                    assert isinstance(encoded.l, interval.BACKENDS[name])
+    finally:
+        interval.set_backend("sympy")
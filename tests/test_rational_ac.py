@@ -0,0 +1,95 @@
+import concurrent.futures
+import itertools
+
+from pysteg.coding.interval import bits2interval
+from pysteg.coding.interval import interval2bits
+from pysteg.coding.interval import random_interval
+from pysteg.coding.rational_ac import EncodingTrie
+from pysteg.coding.rational_ac import IncrementalEncoder
+from pysteg.coding.rational_ac import decode
+from pysteg.coding.rational_ac import deep_decode
+from pysteg.coding.rational_ac import encode
+from pysteg.coding.rational_ac import init_encode_worker
+from pysteg.coding.rational_ac import iter_decode
+from pysteg.coding.rational_ac import iter_deep_decode
+from pysteg.coding.rational_ac import parallel_encode
+from pysteg.coding.rational_ac import stream_encode
+from pysteg.coding.rational_ac import worker_conditional_interval
+
+def test_encoding_trie(lm, bindb_fixture):
+    sentences = bindb_fixture.sentences[:30]
+
+    for max_nodes in (1, 10, 100000):
+        trie = EncodingTrie(lm.conditional_interval, max_nodes)
+
+        for sentence in sentences + sentences:
+            assert trie.encode(sentence) == encode(lm.conditional_interval,
+                                                   sentence)
+
+        assert len(trie.nodes) <= max_nodes
+
+    assert trie.reused > 0
+
+def test_stream_encode(lm, bindb_fixture):
+    for sentence in bindb_fixture.sentences[:20]:
+        interval = encode(lm.conditional_interval, sentence)
+
+        for mode in ("sub", "super"):
+            assert tuple(stream_encode(lm.conditional_interval, sentence,
+                                       mode, lm.n_max-1)) == tuple(
+                interval2bits(interval, mode))
+
+def test_stream_encode_precision(lm, bindb_fixture):
+    symbols = tuple(itertools.chain(*bindb_fixture.sentences[:50]))
+    encoder = IncrementalEncoder(lm.conditional_interval, lm.n_max-1,
+                                 precision=32)
+    bits = []
+
+    for symbol in symbols:
+        bits += encoder.encode(symbol)
+
+        # Only the precision and a few unsettled bits are kept
+        assert encoder.interval.l.denominator.bit_length() < 64
+
+    bits += encoder.finish("sub")
+
+    assert decode(lm.next, bits2interval(bits),
+                  precision=32).sequence[:len(symbols)] == symbols
+
+def test_parallel_encode(lm, bindb_fixture):
+    sentences = bindb_fixture.sentences[:20]
+    expected = tuple(encode(lm.conditional_interval, s) for s in sentences)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            2, initializer=init_encode_worker, initargs=(lm,)) as executor:
+        assert tuple(parallel_encode(worker_conditional_interval, s, executor,
+                                     lm.n_max-1, chunksize=4)
+                     for s in sentences) == expected
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert tuple(parallel_encode(lm.conditional_interval, s, executor,
+                                     lm.n_max-1)
+                     for s in sentences) == expected
+
+def test_iter_decode(lm):
+    for seed in range(10):
+        interval = random_interval(64, seed=seed)
+        decoded = tuple(iter_decode(lm.next, interval))
+
+        assert decoded[-1].checkpoint.sequence == decode(lm.next,
+                                                         interval).sequence
+
+        # Resuming from any checkpoint gives the rest of the symbols
+        for (k, symbol) in enumerate(decoded):
+            assert tuple(iter_decode(lm.next, interval,
+                                     checkpoint=symbol.checkpoint)) == (
+                decoded[k+1:])
+
+def test_iter_deep_decode(lm):
+    for seed in range(10):
+        interval = random_interval(64, seed=seed)
+        decoded = tuple(iter_deep_decode(lm.next, interval, end=lm.end,
+                                         seed=seed))
+
+        assert decoded[-1].checkpoint.sequence == deep_decode(
+            lm.next, interval, end=lm.end, seed=seed).sequence
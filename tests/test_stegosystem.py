@@ -0,0 +1,51 @@
+import pytest
+
+from pysteg.googlebooks.ngrams_analysis import token_strings2text
+from pysteg.stegosystem import BinaryStegosystem
+from pysteg.stegosystem import BlockFraming
+from pysteg.stegosystem import BlockPlaintext
+from pysteg.stegosystem import BlockStegotext
+from pysteg.stegosystem import Key
+from pysteg.stegosystem import Plaintext
+from pysteg.stegosystem import frame_blocks
+
+TEXT = ("the of and a to.  you that it he was for on are as with his they.  "
+        "water oil people call who?  come made may part, the the the!")
+
+def test_block_round_trip(lm, bindb_fixture):
+    index = bindb_fixture.index
+    framing = BlockFraming(sentences=2, chunk_bits=48, length_bits=16)
+    k = Key(index, lm, "save", "one had by word but not what")
+
+    results = []
+
+    for processes in (1, 2):
+        bs = BinaryStegosystem(index, lm, framing, processes=processes)
+        p = BlockPlaintext(index, lm, framing, "save", TEXT, processes)
+        s = bs.pk2s(p, k)
+
+        # The stegotext is split into the same blocks when read as text
+        s2 = BlockStegotext(index, lm, framing, "save",
+                            token_strings2text(s.token_strings))
+        assert (s2.blocks, s2.bits) == (s.blocks, s.bits)
+
+        assert bs.sk2p(s2, k).token_indices == p.token_indices
+        results.append((p.bits, s.bits))
+
+    assert results[0][0] == results[1][0]
+    assert "Framing" in str(s)
+
+    # Text without blocks cannot be coded by a stegosystem with framing
+    with pytest.raises(TypeError):
+        bs.pk2s(Plaintext(index, lm, "save", TEXT), k)
+
+def test_frame_blocks_overflow():
+    framing = BlockFraming(sentences=2, chunk_bits=48, length_bits=4)
+
+    frame_blocks(((1,) * 15,), 2, framing)
+
+    for (blocks_bits, last_sentences) in ((((1,) * 16,), 2),
+                                          (((1,),) * 16, 2),
+                                          (((1,),), 16)):
+        with pytest.raises(ValueError):
+            frame_blocks(blocks_bits, last_sentences, framing)